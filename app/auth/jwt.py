@@ -1,16 +1,25 @@
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import timedelta
+from typing import Optional, Tuple
+import hashlib
+import math
 import os
+import secrets
+import threading
+import time
 
-from jose import jwt, JWTError
+from cachetools import TLRUCache, TTLCache
+import jwt
+from jwt import DecodeError, PyJWTError
+import orjson
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.orm import Session, make_transient_to_detached
 
 from app.database.connection import get_db
-from app.models import User
-from app.schemas.token import TokenData
+from app.models import User, UserRole
+from app.models.users import teacher_subject
 
 # Secret key and algorithm configuration loaded from environment variables
 # Raise an error if secret key is not provided to prevent using insecure defaults
@@ -20,6 +29,52 @@ if not SECRET_KEY:
 
 ALGORITHM = os.environ.get("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+TOKEN_CACHE_MAXSIZE = int(os.environ.get("TOKEN_CACHE_MAXSIZE", "10000"))
+# How long another worker's change to a user (e.g. deactivation) can go unnoticed by this one
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "60"))
+_DEFAULT_EXPIRY_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+# Resolve the algorithm and prepare the key bytes once instead of on every encode/decode
+_SIGNING_KEY = jwt.get_algorithm_by_name(ALGORITHM).prepare_key(SECRET_KEY.encode("utf-8"))
+
+class _OrjsonJWT(jwt.PyJWT):
+    """
+    PyJWT with the claims encoded and decoded by orjson instead of the stdlib json module
+    """
+    def _encode_payload(self, payload, headers=None, json_encoder=None) -> bytes:
+        return orjson.dumps(payload)
+    
+    def _decode_payload(self, decoded):
+        try:
+            payload = orjson.loads(decoded["payload"])
+        except orjson.JSONDecodeError as e:
+            raise DecodeError(f"Invalid payload string: {e}")
+        if not isinstance(payload, dict):
+            raise DecodeError("Invalid payload string: must be a json object")
+        return payload
+
+_jwt = _OrjsonJWT()
+
+def _token_cache_ttu(key, value, now):
+    # Keep a verified token no longer than its own "exp" claim
+    return min(value[1], now + _DEFAULT_EXPIRY_SECONDS)
+
+# Cache of already verified tokens: digest of the raw token -> [username, exp, user id, subject ids]
+# The user id is filled in once the token's subject has been resolved in the database
+_token_cache = TLRUCache(maxsize=TOKEN_CACHE_MAXSIZE, ttu=_token_cache_ttu, timer=time.time)
+_token_cache_lock = threading.Lock()
+
+# Tokens revoked by logout in this process: digest of the raw token -> exp
+# Entries expire together with the token; guarded by _token_cache_lock. Unbounded, since evicting
+# a live entry would make its token valid again; expiry keeps it to the logouts of one token lifetime
+_revoked_tokens = TLRUCache(maxsize=math.inf, ttu=lambda key, exp, now: exp, timer=time.time)
+
+# Column values of recently authenticated users: user id -> {column: value}
+# Lets a request attach its user to the session without a SELECT; guarded by _token_cache_lock.
+# The password hash is left out; it loads from the database on the rare access that needs it
+_user_cache = TTLCache(maxsize=TOKEN_CACHE_MAXSIZE, ttl=USER_CACHE_TTL, timer=time.time)
+_user_cache_generation = 0
+_USER_COLUMNS = tuple(column.key for column in User.__table__.columns if column.key != "hashed_password")
 
 # OAuth2 bearer token scheme for FastAPI
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -38,75 +93,195 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     """
     to_encode = data.copy()
     
+    # "exp" is a Unix timestamp, so plain integer arithmetic is enough
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = int(time.time()) + int(expires_delta.total_seconds())
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = int(time.time()) + _DEFAULT_EXPIRY_SECONDS
     
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # A unique ID keeps tokens issued in the same second distinct, so revoking one leaves the others valid
+    to_encode.update({"exp": expire, "jti": secrets.token_hex(16)})
+    encoded_jwt = _jwt.encode(to_encode, _SIGNING_KEY, algorithm=ALGORITHM)
     
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+def _token_cache_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def _verified_token_entry(token: str) -> Optional[list]:
     """
-    Validate the token and return the current user
+    Verify a JWT and return its cache entry, or None if the token is invalid or revoked
     """
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+    key = _token_cache_key(token)
+    
+    # Revoked tokens are evicted from the cache, so a hit is always still valid
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+        revoked = cached is None and key in _revoked_tokens
+    if cached is not None:
+        return cached
+    if revoked:
+        return None
     
     try:
         # Decode the token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        
-        if username is None:
-            raise credentials_exception
-        
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
+        payload = _jwt.decode(token, _SIGNING_KEY, algorithms=[ALGORITHM])
+    except PyJWTError:
+        return None
+    
+    username: str = payload.get("sub")
+    if username is None:
+        return None
+    
+    exp = payload.get("exp")
+    if exp is None:
+        exp = time.time() + _DEFAULT_EXPIRY_SECONDS
+    
+    # Teachers' tokens carry the IDs of their assigned subjects
+    subject_ids = payload.get("subjects")
+    if subject_ids is not None:
+        subject_ids = frozenset(subject_ids)
+    
+    entry = [username, exp, None, subject_ids]
+    with _token_cache_lock:
+        # A logout may have revoked the token while it was being decoded; caching it
+        # now would let every later request through as a cache hit
+        if key in _revoked_tokens:
+            return None
+        _token_cache[key] = entry
+    
+    return entry
+
+def revoke_token(token: str) -> None:
+    """
+    Reject a token for the rest of its lifetime, e.g. after logout
+    """
+    try:
+        payload = _jwt.decode(token, _SIGNING_KEY, algorithms=[ALGORITHM])
+    except PyJWTError:
+        # Invalid or expired tokens are rejected anyway
+        return
+    
+    exp = payload.get("exp")
+    if exp is None:
+        exp = time.time() + _DEFAULT_EXPIRY_SECONDS
     
-    # Get the user from the database
-    user = db.query(User).filter(User.username == token_data.username).first()
+    key = _token_cache_key(token)
+    with _token_cache_lock:
+        _token_cache.pop(key, None)
+        _revoked_tokens[key] = exp
+
+def _cached_user(db: Session, user_id: Optional[int]) -> Tuple[Optional[User], int]:
+    """
+    Attach a user rebuilt from the user cache to the session, without querying the database;
+    also return the cache generation to check before storing a user loaded on a miss
+    """
+    with _token_cache_lock:
+        generation = _user_cache_generation
+        values = _user_cache.get(user_id) if user_id is not None else None
+    if values is None:
+        return None, generation
+    
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False), generation
+
+def forget_cached_user(user_id: int) -> None:
+    """
+    Drop a user from the user cache after their row changed
+    """
+    global _user_cache_generation
+    with _token_cache_lock:
+        _user_cache_generation += 1
+        _user_cache.pop(user_id, None)
+
+def get_token_user(token: str, db: Session) -> Optional[User]:
+    """
+    Return the user a JWT belongs to, or None if the token is invalid or the user is gone
+    """
+    entry = _verified_token_entry(token)
+    if entry is None:
+        return None
+    
+    username, _, user_id, subject_ids = entry
+    user, generation = _cached_user(db, user_id)
+    cached = user is not None
+    if user_id is not None:
+        if user is None:
+            # Primary key lookup, answered from the identity map when the session already holds the user
+            user = db.get(User, user_id)
+        if user is not None and user.username != username:
+            user = None
+            cached = False
     
     if user is None:
-        raise credentials_exception
+        # Get the user from the database
+        user = db.query(User).filter(User.username == username).first()
+        if user is None:
+            return None
+        entry[2] = user.id
+    
+    if not cached:
+        values = {key: getattr(user, key) for key in _USER_COLUMNS}
+        with _token_cache_lock:
+            # Don't store values that a concurrent user change may already have made stale
+            if generation == _user_cache_generation:
+                _user_cache[user.id] = values
     
+    user.token_subject_ids = subject_ids
     return user
 
-def get_current_user_optional(token: str = Depends(oauth2_scheme_optional), db: Session = Depends(get_db), request: Request = None) -> Optional[User]:
+def get_teacher_subject_ids(db: Session, user: User) -> frozenset:
+    """
+    Get the IDs of the subjects assigned to a teacher, from the token claims when available;
+    the claims can be stale until the token expires, so use this for read access only
+    """
+    subject_ids = getattr(user, "token_subject_ids", None)
+    if subject_ids is not None:
+        return subject_ids
+    
+    return frozenset(db.scalars(
+        select(teacher_subject.c.subject_id).where(teacher_subject.c.user_id == user.id)
+    ))
+
+_CREDENTIALS_HEADERS = {"WWW-Authenticate": "Bearer"}
+
+def _credentials_exception() -> HTTPException:
+    # Built only on the failure path; a shared instance would accumulate
+    # traceback frames every time it is re-raised
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers=_CREDENTIALS_HEADERS,
+    )
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+    """
+    Validate the token and return the current user
+    """
+    user = get_token_user(token, db)
+    if user is None:
+        raise _credentials_exception()
+    
+    return user
+
+def get_current_user_optional(request: Request, token: str = Depends(oauth2_scheme_optional), db: Session = Depends(get_db)) -> Optional[User]:
     """
     Validate the token and return the current user, but don't require authentication
     """
-    # First check if user is already in request state (set by middleware)
-    if request and hasattr(request.state, 'user'):
-        return request.state.user
+    # First check if user is already in request state (set by middleware for every page route)
+    user = request.state.user
+    if user is not None:
+        return user
         
     if token is None:
         return None
-        
-    try:
-        # Decode the token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        
-        if username is None:
-            return None
-        
-        token_data = TokenData(username=username)
-    except JWTError:
-        return None
-    
-    # Get the user from the database
-    user = db.query(User).filter(User.username == token_data.username).first()
     
-    return user
+    return get_token_user(token, db)
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+# The checks below only read attributes of the already loaded user, so they are
+# async to run on the event loop instead of taking a threadpool hop each
+async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     """
     Check if the current user is active
     """
@@ -115,11 +290,31 @@ def get_current_active_user(current_user: User = Depends(get_current_user)) -> U
     
     return current_user
 
-def get_current_verified_user(current_user: User = Depends(get_current_active_user)) -> User:
+async def get_current_verified_user(current_user: User = Depends(get_current_active_user)) -> User:
     """
     Check if the current user is verified
     """
     if not current_user.is_verified:
         raise HTTPException(status_code=400, detail="User not verified")
     
-    return current_user 
\ No newline at end of file
+    return current_user 
+
+def require_roles(allowed: frozenset):
+    """
+    Build a dependency that returns the verified current user if their role is in allowed, else raises 403
+    """
+    async def role_checker(current_user: User = Depends(get_current_verified_user)) -> User:
+        if current_user.role not in allowed:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not enough permissions"
+            )
+        return current_user
+    
+    return role_checker
+
+# Dependency for the journal-editing endpoints open to teachers and admins
+get_current_teacher_or_admin = require_roles(frozenset({UserRole.TEACHER, UserRole.ADMIN}))
+
+# Dependency for the admin-only endpoints
+get_current_admin = require_roles(frozenset({UserRole.ADMIN}))
@@ -1,16 +1,52 @@
-from passlib.context import CryptContext
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+import bcrypt
+import os
+import threading
 
-# Create password context using bcrypt
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# New passwords are hashed with argon2id; bcrypt hashes from older accounts are still accepted.
+# Defaults are argon2-cffi's (3 passes, 64 MiB, 4 lanes); lower the memory cost on small hosts
+_argon2 = PasswordHasher(
+    time_cost=int(os.getenv("ARGON2_TIME_COST", "3")),
+    memory_cost=int(os.getenv("ARGON2_MEMORY_COST", "65536")),
+    parallelism=int(os.getenv("ARGON2_PARALLELISM", "4")),
+)
+
+# Hashing runs in the sync routes' worker threads and releases the GIL; cap how many hashes
+# run at once so a burst of logins can't allocate memory_cost for every thread in the pool
+_hash_slots = threading.BoundedSemaphore(int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(os.cpu_count() or 4))))
+
+# Verified against when a login names an unknown user, so the response takes as long as a real check
+DUMMY_PASSWORD_HASH = _argon2.hash("dummy-password")
 
 def hash_password(password: str) -> str:
     """
-    Hash a password using bcrypt
+    Hash a password using argon2id
     """
-    return pwd_context.hash(password)
+    with _hash_slots:
+        return _argon2.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
-    Verify a password against a hash
+    Verify a password against an argon2id or legacy bcrypt hash
+    """
+    if hashed_password.startswith("$argon2"):
+        try:
+            with _hash_slots:
+                return _argon2.verify(hashed_password, plain_password)
+        except (VerificationError, InvalidHashError):
+            return False
+    
+    try:
+        with _hash_slots:
+            return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+    except ValueError:
+        return False
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """
+    Check if a hash should be replaced with one using the current argon2id parameters
     """
-    return pwd_context.verify(plain_password, hashed_password) 
\ No newline at end of file
+    if not hashed_password.startswith("$argon2"):
+        return True
+    return _argon2.check_needs_rehash(hashed_password)
@@ -0,0 +1,35 @@
+from cachetools import TTLCache
+import threading
+
+class LoadingCache:
+    """
+    Per-worker TTL cache filled by a loader on a miss; clear() also discards loads still in flight,
+    so a write that finishes while a value is being loaded never leaves the old value cached
+    """
+    def __init__(self, maxsize: int, ttl: int):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._generation = 0
+    
+    def get_or_load(self, key, load):
+        """
+        Return the cached value for key, calling load() and caching its result on a miss
+        """
+        with self._lock:
+            cached = self._cache.get(key)
+            generation = self._generation
+        if cached is None:
+            cached = load()
+            with self._lock:
+                # Don't store a value that a concurrent write may already have made stale
+                if generation == self._generation:
+                    self._cache[key] = cached
+        return cached
+    
+    def clear(self) -> None:
+        """
+        Drop every cached value, e.g. after the data behind them changed
+        """
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
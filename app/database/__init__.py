@@ -1,4 +1,4 @@
-from app.database.connection import engine, Base, get_db, SessionLocal
+from app.database.connection import engine, Base, get_db, SessionLocal, count_queries
 # Import models for SQLAlchemy to detect them
 from app.models.users import User
 from app.models.journal import (
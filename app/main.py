@@ -1,32 +1,86 @@
 from fastapi import FastAPI, Request, Depends, HTTPException, status, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, ORJSONResponse
 from fastapi.security import HTTPBearer
 from starlette.middleware.sessions import SessionMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 import os
 from typing import Optional
+import re
 import urllib.parse
+from contextlib import asynccontextmanager
+import anyio
 from starlette.middleware.base import BaseHTTPMiddleware
-from datetime import datetime
+from starlette.concurrency import run_in_threadpool
 import secrets
 
-from app.database.connection import get_db, engine
+from app.database.connection import get_db, engine, SessionLocal
 from app.models import Base
 from app.routes import auth_router, users_router, journal_router
-from app.auth.jwt import get_current_user, get_current_user_optional
+from app.auth.jwt import get_current_user, get_current_user_optional, get_teacher_subject_ids
 from app.models import User, Faculty, Group, Subject, SubjectGroup, UserRole
+from app.models.users import ROLE_CODES
 from app.schemas import JournalView
 from app.services import get_journal_view
 from app.auth.password import hash_password
-from sqlalchemy import text
+from app.templating import templates, journal_url
+from sqlalchemy import text, select, and_
+from sqlalchemy.schema import AddConstraint
 import logging
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Set up logging; keep INFO in production so debug messages are never formatted
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
+# Indexes the original schema created that the models no longer declare; the primary keys,
+# ix_users_username_login and ix_group_faculty_name cover them
+REDUNDANT_INDEXES = (
+    "ix_users_id", "ix_users_username", "ix_faculties_id", "ix_groups_id", "ix_groups_name",
+    "ix_subjects_id", "ix_subject_groups_id", "ix_grades_id", "ix_attendance_id", "ix_student_subjects_id",
+)
+
+# One-off cleanups for older databases that allowed duplicates a model's unique index now rejects:
+# unique index -> DELETE that keeps the newest row of each duplicate group and returns the rows it
+# removed. Each runs only while its index is still missing, so never again once the index is built
+UNIQUE_INDEX_DEDUPES = {
+    "ix_student_subjects_pair": (
+        "DELETE FROM student_subjects a USING student_subjects b "
+        "WHERE a.student_id = b.student_id AND a.subject_id = b.subject_id AND a.id < b.id "
+        "RETURNING a.id"
+    ),
+    # A later mark for the same student, subject-group and day is usually a correction
+    "ix_attendance_student_day": (
+        "DELETE FROM attendance a USING attendance b "
+        "WHERE a.student_id = b.student_id AND a.subject_group_id = b.subject_group_id "
+        "AND a.date = b.date AND a.id < b.id "
+        "RETURNING a.id"
+    ),
+    # teacher_subject has no id column, so keep the physically last copy of each pair
+    "ix_teacher_subject_pair": (
+        "DELETE FROM teacher_subject a USING teacher_subject b "
+        "WHERE a.user_id = b.user_id AND a.subject_id = b.subject_id AND a.ctid < b.ctid "
+        "RETURNING a.user_id, a.subject_id"
+    ),
+}
+
+def dedupe_for_unique_indexes(conn) -> None:
+    """
+    Remove the duplicate rows that would keep a model's unique index from being built, logging each removed row
+    """
+    existing = set(conn.scalars(
+        text("SELECT indexname FROM pg_indexes WHERE indexname = ANY(:names)"),
+        {"names": list(UNIQUE_INDEX_DEDUPES)}
+    ))
+    for index_name, delete_sql in UNIQUE_INDEX_DEDUPES.items():
+        if index_name in existing:
+            continue
+        removed = conn.execute(text(delete_sql)).all()
+        if removed:
+            logger.warning(
+                "Removed %s duplicate rows before building unique index %s: %s",
+                len(removed), index_name, [tuple(row) for row in removed]
+            )
+
 # Create tables in the database with proper enum handling
 def init_database():
     try:
@@ -49,16 +103,71 @@ def init_database():
                 
                 if table_exists:
                     logger.info("Database tables already exist, skipping initialization")
+                    
+                    # Older databases store users.role as a PostgreSQL enum of role names
+                    role_type = conn.execute(text(
+                        "SELECT data_type FROM information_schema.columns "
+                        "WHERE table_name = 'users' AND column_name = 'role'"
+                    )).scalar()
+                    if role_type == "USER-DEFINED":
+                        logger.info("Converting users.role to smallint codes")
+                        cases = " ".join(f"WHEN '{role.name}' THEN {code}" for role, code in ROLE_CODES.items())
+                        conn.execute(text(
+                            f"ALTER TABLE users ALTER COLUMN role TYPE smallint USING (CASE role::text {cases} END)"
+                        ))
+                        conn.execute(text("DROP TYPE IF EXISTS userrole"))
+                    
+                    # Older databases did not enforce uniqueness the models now declare;
+                    # drop the duplicates once so the unique indexes below can be built
+                    dedupe_for_unique_indexes(conn)
                 else:
                     logger.info("Initializing database tables")
-                    # Create all tables using SQLAlchemy (handles enums automatically)
+                    # Create all tables using SQLAlchemy
                     Base.metadata.create_all(bind=engine)
                     logger.info("Database tables created successfully")
                 
+                # create_all only builds indexes for new tables, so add any index
+                # declared on the models that an existing database is still missing
+                for table in Base.metadata.sorted_tables:
+                    for index in table.indexes:
+                        index.create(bind=conn, checkfirst=True)
+                
+                # Older databases were created without ON DELETE rules; rebuild those
+                # foreign keys so deletes cascade in the database like on fresh installs
+                delete_rules = {
+                    (row.table_name, row.column_name): (row.constraint_name, row.delete_rule)
+                    for row in conn.execute(text(
+                        "SELECT kcu.table_name, kcu.column_name, rc.constraint_name, rc.delete_rule "
+                        "FROM information_schema.referential_constraints rc "
+                        "JOIN information_schema.key_column_usage kcu "
+                        "ON kcu.constraint_name = rc.constraint_name AND kcu.constraint_schema = rc.constraint_schema"
+                    ))
+                }
+                for table in Base.metadata.sorted_tables:
+                    for fk in table.foreign_key_constraints:
+                        existing = delete_rules.get((table.name, fk.column_keys[0]))
+                        if fk.ondelete and existing and existing[1] != fk.ondelete.upper():
+                            logger.info(f"Rebuilding foreign key {existing[0]} with ON DELETE {fk.ondelete}")
+                            conn.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT "{existing[0]}"'))
+                            conn.execute(AddConstraint(fk))
+                
+                # Drop indexes older versions created that duplicate a primary key or another index;
+                # only the ones still present, so an upgraded database takes no locks for them
+                redundant = conn.scalars(
+                    text("SELECT indexname FROM pg_indexes WHERE indexname = ANY(:names)"),
+                    {"names": list(REDUNDANT_INDEXES)}
+                ).all()
+                for index_name in redundant:
+                    logger.info("Dropping redundant index %s", index_name)
+                    conn.execute(text(f"DROP INDEX {index_name}"))
+                
+                # Commit the schema changes now: they hold ACCESS EXCLUSIVE locks on the tables,
+                # and the session below queries users on another connection. The advisory lock
+                # is session-level, so it stays held until the unlock below
+                conn.commit()
+                
                 # Create default admin user if it doesn't exist
-                from sqlalchemy.orm import sessionmaker
-                Session = sessionmaker(bind=engine)
-                db = Session()
+                db = SessionLocal()
                 
                 try:
                     admin = db.query(User).filter(User.username == "admin").first()
@@ -93,65 +202,31 @@ def init_database():
 if __name__ == "__main__" or os.getenv("INIT_DB", "true").lower() == "true":
     init_database()
 
-# Create FastAPI app
-app = FastAPI(title="Student Journal")
+# Sync routes (auth, journal CRUD) run in AnyIO's worker threadpool; size it to the DB pool
+THREADPOOL_SIZE = os.getenv("THREADPOOL_SIZE")
 
-# Add session middleware for flash messages and CSRF
-app.add_middleware(
-    SessionMiddleware,
-    secret_key=secrets.token_hex(32),
-    session_cookie="session",
-    max_age=14 * 24 * 60 * 60,  # 14 days
-    same_site="lax",
-    https_only=False
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if THREADPOOL_SIZE:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = int(THREADPOOL_SIZE)
+    yield
+
+# Create FastAPI app
+# Interactive docs and the OpenAPI schema are only served outside production
+IS_PRODUCTION = os.getenv("ENV", "").lower() == "prod"
+app = FastAPI(
+    title="Student Journal",
+    docs_url=None if IS_PRODUCTION else "/docs",
+    redoc_url=None if IS_PRODUCTION else "/redoc",
+    openapi_url=None if IS_PRODUCTION else "/openapi.json",
+    lifespan=lifespan,
+    # orjson serializes API responses several times faster than the stdlib encoder
+    default_response_class=ORJSONResponse
 )
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
-# Set up Jinja2 templates
-templates = Jinja2Templates(directory="app/templates")
-
-# Add custom filters to Jinja2
-def format_date(value):
-    if isinstance(value, str):
-        try:
-            value = datetime.strptime(value, "%Y-%m-%d")
-        except ValueError:
-            return value
-    if isinstance(value, datetime):
-        return value.strftime("%d.%m.%Y")
-    return value
-
-templates.env.filters["date"] = format_date
-
-# Helper function to get flash messages
-def get_flash_messages(request: Request):
-    messages = request.session.get("flash_messages", [])
-    request.session["flash_messages"] = []
-    return messages
-
-# Add global template context
-@app.middleware("http")
-async def add_template_context(request: Request, call_next):
-    response = await call_next(request)
-    
-    # Add CSRF token to template context
-    if "csrf_token" not in request.session:
-        request.session["csrf_token"] = secrets.token_hex(32)
-    
-    # Add flash messages to template context
-    if "flash_messages" not in request.session:
-        request.session["flash_messages"] = []
-    
-    return response
-
-# Helper function to add flash messages
-def flash(request: Request, message: str, category: str = "info"):
-    if "flash_messages" not in request.session:
-        request.session["flash_messages"] = []
-    request.session["flash_messages"].append({"message": message, "category": category})
-
 # Add API routers - these must be added BEFORE the journal page route
 app.include_router(auth_router)
 app.include_router(users_router)
@@ -164,8 +239,7 @@ async def home(request: Request, current_user: Optional[User] = Depends(get_curr
         "index.html", 
         {
             "request": request, 
-            "user": current_user,
-            "get_flash_messages": get_flash_messages
+            "user": current_user
         }
     )
 
@@ -179,8 +253,7 @@ async def register_page(request: Request, current_user: Optional[User] = Depends
         "register.html", 
         {
             "request": request, 
-            "user": None,
-            "get_flash_messages": get_flash_messages
+            "user": None
         }
     )
 
@@ -197,8 +270,7 @@ async def admin_panel(request: Request, current_user: Optional[User] = Depends(g
                 "request": request,
                 "user": current_user,
                 "error": "You do not have permission to access the admin panel.",
-                "status_code": 403,
-                "get_flash_messages": get_flash_messages
+                "status_code": 403
             }
         )
     
@@ -206,14 +278,14 @@ async def admin_panel(request: Request, current_user: Optional[User] = Depends(g
         "admin.html", 
         {
             "request": request, 
-            "user": current_user,
-            "get_flash_messages": get_flash_messages
+            "user": current_user
         }
     )
 
 # Journal view page - Add a specific route for journal access
+# Declared as a plain def so FastAPI runs its blocking DB queries in the threadpool
 @app.get("/journal/{faculty}/{group}/{subject}", response_class=HTMLResponse)
-async def journal_explicit_page(
+def journal_explicit_page(
     request: Request, 
     faculty: str,
     group: str,
@@ -221,149 +293,112 @@ async def journal_explicit_page(
     db: Session = Depends(get_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
-    # Try to URL decode parameters (in case they're already decoded, this won't change them)
-    try:
+    # FastAPI has already decoded the path; only unquote values that are still percent-encoded
+    if "%" in faculty:
         faculty = urllib.parse.unquote(faculty)
+    if "%" in group:
         group = urllib.parse.unquote(group)
+    if "%" in subject:
         subject = urllib.parse.unquote(subject)
-    except Exception as e:
-        print(f"Error decoding URL parameters: {e}")
     
     # Debug information
-    print(f"Accessing journal explicit page with: faculty={faculty}, group={group}, subject={subject}")
-    print(f"Current user: {current_user}")
+    logger.debug("Accessing journal explicit page with: faculty=%s, group=%s, subject=%s", faculty, group, subject)
+    logger.debug("Current user: %s", current_user)
     
     if not current_user:
-        print("No current user, redirecting to login")
+        logger.debug("No current user, redirecting to login")
         return RedirectResponse("/login", status_code=status.HTTP_303_SEE_OTHER)
     
     if not current_user.is_verified:
-        print("User not verified")
+        logger.debug("User not verified")
         return templates.TemplateResponse(
             "error.html",
             {
                 "request": request,
                 "user": current_user,
-                "error": "Your account has not been verified yet. Please wait for an admin to verify your account.",
-                "get_flash_messages": get_flash_messages
+                "error": "Your account has not been verified yet. Please wait for an admin to verify your account."
             }
         )
     
     try:
-        # Get the faculty, group, and subject by name
-        print(f"Looking for faculty: {faculty}")
-        db_faculty = db.query(Faculty).filter(Faculty.name == faculty).first()
-        if not db_faculty:
-            print(f"Faculty '{faculty}' not found")
-            return templates.TemplateResponse(
-                "error.html",
-                {
-                    "request": request,
-                    "user": current_user,
-                    "error": f"Faculty '{faculty}' not found",
-                    "status_code": 404,
-                    "get_flash_messages": get_flash_messages
-                },
-                status_code=404
-            )
-        print(f"Found faculty: {db_faculty.name} (ID: {db_faculty.id})")
-        
-        print(f"Looking for group: {group} in faculty {db_faculty.id}")
-        db_group = db.query(Group).filter(Group.name == group, Group.faculty_id == db_faculty.id).first()
-        if not db_group:
-            print(f"Group '{group}' not found in faculty {db_faculty.name}")
-            return templates.TemplateResponse(
-                "error.html",
-                {
-                    "request": request,
-                    "user": current_user,
-                    "error": f"Group '{group}' not found in faculty '{faculty}'",
-                    "status_code": 404,
-                    "get_flash_messages": get_flash_messages
-                },
-                status_code=404
-            )
-        print(f"Found group: {db_group.name} (ID: {db_group.id})")
-        
-        print(f"Looking for subject: {subject} in faculty {db_faculty.id}")
-        db_subject = db.query(Subject).filter(Subject.name == subject, Subject.faculty_id == db_faculty.id).first()
-        if not db_subject:
-            print(f"Subject '{subject}' not found in faculty {db_faculty.name}")
-            return templates.TemplateResponse(
-                "error.html",
-                {
-                    "request": request,
-                    "user": current_user,
-                    "error": f"Subject '{subject}' not found in faculty '{faculty}'",
-                    "status_code": 404,
-                    "get_flash_messages": get_flash_messages
-                },
-                status_code=404
-            )
-        print(f"Found subject: {db_subject.name} (ID: {db_subject.id})")
-        
-        # Get subject-group relationship
-        print(f"Looking for subject-group relationship: subject_id={db_subject.id}, group_id={db_group.id}")
-        subject_group = db.query(SubjectGroup).filter(
-            SubjectGroup.subject_id == db_subject.id,
-            SubjectGroup.group_id == db_group.id
+        # Resolve the faculty, group, subject and their relationship in one query
+        logger.debug("Looking for journal: faculty=%s, group=%s, subject=%s", faculty, group, subject)
+        row = db.execute(
+            select(Faculty.id, Group.id, Subject.id, SubjectGroup.id)
+            .select_from(Faculty)
+            .join(Group, Group.faculty_id == Faculty.id)
+            .join(Subject, Subject.faculty_id == Faculty.id)
+            .join(SubjectGroup, and_(
+                SubjectGroup.subject_id == Subject.id,
+                SubjectGroup.group_id == Group.id
+            ))
+            .where(Faculty.name == faculty, Group.name == group, Subject.name == subject)
         ).first()
         
-        if not subject_group:
-            print(f"No relationship between subject '{subject}' and group '{group}'")
+        if row is None:
+            # Not found - look the parts up one by one to report which one is missing
+            db_faculty = db.query(Faculty).filter(Faculty.name == faculty).first()
+            if not db_faculty:
+                error = f"Faculty '{faculty}' not found"
+            elif not db.query(Group.id).filter(Group.name == group, Group.faculty_id == db_faculty.id).first():
+                error = f"Group '{group}' not found in faculty '{faculty}'"
+            elif not db.query(Subject.id).filter(Subject.name == subject, Subject.faculty_id == db_faculty.id).first():
+                error = f"Subject '{subject}' not found in faculty '{faculty}'"
+            else:
+                error = f"No relationship between subject '{subject}' and group '{group}'"
+            logger.debug(error)
             return templates.TemplateResponse(
                 "error.html",
                 {
                     "request": request,
                     "user": current_user,
-                    "error": f"No relationship between subject '{subject}' and group '{group}'",
-                    "status_code": 404,
-                    "get_flash_messages": get_flash_messages
+                    "error": error,
+                    "status_code": 404
                 },
                 status_code=404
             )
-        print(f"Found subject-group relationship: ID={subject_group.id}")
+        
+        faculty_id, group_id, subject_id, subject_group_id = row
+        logger.debug("Found subject-group relationship: ID=%s", subject_group_id)
         
         # Check permissions
         if current_user.role == UserRole.STUDENT:
             # Students can only view journals for their own group
-            if current_user.group_id != db_group.id:
-                print(f"Student not in group {db_group.name}")
+            if current_user.group_id != group_id:
+                logger.debug("Student not in group %s", group)
                 return templates.TemplateResponse(
                     "error.html",
                     {
                         "request": request,
                         "user": current_user,
                         "error": "Not enough permissions",
-                        "status_code": 403,
-                        "get_flash_messages": get_flash_messages
+                        "status_code": 403
                     },
                     status_code=403
                 )
         elif current_user.role == UserRole.TEACHER:
             # Teachers can only view journals for subjects they teach
-            teacher_subjects = [s.id for s in current_user.subjects]
-            if db_subject.id not in teacher_subjects:
-                print(f"Teacher does not teach subject {db_subject.name}")
+            teacher_subjects = get_teacher_subject_ids(db, current_user)
+            if subject_id not in teacher_subjects:
+                logger.debug("Teacher does not teach subject %s", subject)
                 return templates.TemplateResponse(
                     "error.html",
                     {
                         "request": request,
                         "user": current_user,
                         "error": "You don't have access to this subject",
-                        "status_code": 403,
-                        "get_flash_messages": get_flash_messages
+                        "status_code": 403
                     },
                     status_code=403
                 )
         
         # Get journal data
-        print("Getting journal view data")
+        logger.debug("Getting journal view data")
         try:
-            journal = get_journal_view(db, db_subject.id, db_group.id)
-            print("Journal data retrieved successfully")
+            journal = get_journal_view(db, subject_id, group_id)
+            logger.debug("Journal data retrieved successfully")
         except Exception as journal_error:
-            print(f"Error retrieving journal data: {str(journal_error)}")
+            logger.error("Error retrieving journal data: %s", journal_error)
             error_detail = str(journal_error) if str(journal_error) else "Unknown error retrieving journal data"
             return templates.TemplateResponse(
                 "error.html",
@@ -371,8 +406,7 @@ async def journal_explicit_page(
                     "request": request,
                     "user": current_user,
                     "error": f"Error loading journal: {error_detail}",
-                    "status_code": 500,
-                    "get_flash_messages": get_flash_messages
+                    "status_code": 500
                 },
                 status_code=500
             )
@@ -383,21 +417,19 @@ async def journal_explicit_page(
                 "request": request, 
                 "user": current_user, 
                 "journal": journal,
-                "subject_group_id": subject_group.id,
-                "get_flash_messages": get_flash_messages
+                "subject_group_id": subject_group_id
             }
         )
     except Exception as e:
         error_message = str(e) if str(e) else "Unknown error"
-        print(f"Error in journal_page: {error_message}")
+        logger.exception("Error in journal_page: %s", error_message)
         return templates.TemplateResponse(
             "error.html",
             {
                 "request": request,
                 "user": current_user,
                 "error": f"An error occurred while loading the journal: {error_message}",
-                "status_code": 500,
-                "get_flash_messages": get_flash_messages
+                "status_code": 500
             },
             status_code=500
         )
@@ -411,32 +443,31 @@ async def journal_page_redirect(
     subject: str
 ):
     # Redirect to the explicit journal page
-    encoded_faculty = urllib.parse.quote(faculty)
-    encoded_group = urllib.parse.quote(group)
-    encoded_subject = urllib.parse.quote(subject)
-    redirect_url = f"/journal/{encoded_faculty}/{encoded_group}/{encoded_subject}"
-    return RedirectResponse(redirect_url, status_code=status.HTTP_302_FOUND)
+    return RedirectResponse(journal_url(faculty, group, subject), status_code=status.HTTP_302_FOUND)
 
 # Debug route
 @app.get("/debug/database", response_class=HTMLResponse)
-async def debug_database(
+def debug_database(
     request: Request,
     db: Session = Depends(get_db),
 ):
     """Debug route to check database entries"""
-    faculties = db.query(Faculty).all()
+    # Load the whole faculty -> group -> subject tree up front instead of querying per row
+    faculties = db.query(Faculty).options(
+        selectinload(Faculty.groups)
+        .selectinload(Group.subject_groups)
+        .selectinload(SubjectGroup.subject)
+    ).all()
     faculty_data = []
     
     for faculty in faculties:
-        groups = db.query(Group).filter(Group.faculty_id == faculty.id).all()
         group_data = []
         
-        for group in groups:
-            subject_groups = db.query(SubjectGroup).filter(SubjectGroup.group_id == group.id).all()
-            subject_ids = [sg.subject_id for sg in subject_groups]
-            subjects = db.query(Subject).filter(Subject.id.in_(subject_ids)).all()
-            
-            subject_data = [{"id": subject.id, "name": subject.name} for subject in subjects]
+        for group in faculty.groups:
+            subject_data = [
+                {"id": sg.subject.id, "name": sg.subject.name}
+                for sg in group.subject_groups
+            ]
             
             group_data.append({
                 "id": group.id,
@@ -477,8 +508,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             "user": None,
             "error_title": f"Помилка {exc.status_code}",
             "error_message": exc.detail or error_messages.get(exc.status_code, "Невідома помилка"),
-            "error_details": None,
-            "get_flash_messages": get_flash_messages
+            "error_details": None
         },
         status_code=exc.status_code
     )
@@ -492,8 +522,7 @@ async def not_found_exception_handler(request: Request, exc: HTTPException):
             "user": None,
             "error_title": "Помилка 404",
             "error_message": "Сторінку не знайдено",
-            "error_details": None,
-            "get_flash_messages": get_flash_messages
+            "error_details": None
         },
         status_code=404
     )
@@ -507,69 +536,98 @@ async def server_error_exception_handler(request: Request, exc: Exception):
             "user": None,
             "error_title": "Помилка 500",
             "error_message": "Внутрішня помилка сервера",
-            "error_details": str(exc) if app.debug else None,
-            "get_flash_messages": get_flash_messages
+            "error_details": str(exc) if app.debug else None
         },
         status_code=500
     )
 
+def load_request_user(db: Session, token: str) -> User:
+    """
+    Look up the user for a token and release the session's connection afterwards
+    """
+    try:
+        return get_current_user(token=token, db=db)
+    finally:
+        # End the read transaction so the pooled connection is not held while
+        # the response renders; the route checks out a new one only if it queries
+        db.commit()
+
+# Paths that never need the session: static files, API docs and the JSON API
+SESSIONLESS_PATH_RE = re.compile(r"/(?:api/|static|docs|openapi\.json)")
+# Paths served without authentication
+PUBLIC_PATH_RE = re.compile(r"/(?:token|login|register|public)")
+
 # Middleware to get the current user for all requests
 @app.middleware("http")
 async def get_user_middleware(request: Request, call_next):
-    # Skip API routes and public endpoints
-    if request.url.path.startswith(("/api/", "/token", "/login", "/register", "/static", "/public", "/docs", "/openapi.json")):
+    # Read the raw path from the scope instead of building request.url
+    path = request.scope["path"]
+    
+    # Static files and the JSON API never render templates, so leave the session alone
+    if SESSIONLESS_PATH_RE.match(path):
         return await call_next(request)
     
-    # Debug - print the path
-    print(f"Accessing path: {request.url.path}")
+    # Pre-set the auth attributes so later reads never hit State's missing-key path
+    state = request.state
+    state.user = None
+    state.token = None
     
-    # Try to get the token from cookies
-    token = None
+    # Add CSRF token and flash messages to template context (generated once per session)
+    if "csrf_token" not in request.session:
+        request.session["csrf_token"] = secrets.token_hex(32)
+    if "flash_messages" not in request.session:
+        request.session["flash_messages"] = []
     
-    # Check all cookies for debugging
-    print(f"Cookies: {request.cookies}")
+    # Skip authentication for public endpoints
+    if PUBLIC_PATH_RE.match(path):
+        return await call_next(request)
+    
+    logger.debug("Accessing path: %s", path)
     
-    # Get the token from cookies
-    token = request.cookies.get("access_token")
-    if token and token.startswith("Bearer "):
-        token = token[7:]  # Remove "Bearer " prefix
-        print(f"Found token in cookies: {token[:10]}...")
+    headers = request.headers
+    token = None
+    
+    # Get the token from cookies; only parse the Cookie header when it can contain one
+    if "access_token" in headers.get("cookie", ""):
+        token = request.cookies.get("access_token")
+        if token and token.startswith("Bearer "):
+            token = token[7:]  # Remove "Bearer " prefix
+            logger.debug("Found token in cookies")
     
     # If no token in cookies, try to get from Authorization header
     if not token:
-        auth_header = request.headers.get("Authorization")
-        print(f"Authorization header: {auth_header}")
+        auth_header = headers.get("authorization")
         if auth_header and auth_header.startswith("Bearer "):
             token = auth_header[7:]  # Remove "Bearer " prefix
-            print(f"Found token in headers: {token[:10]}...")
+            logger.debug("Found token in headers")
     
     # Also check for localStorage token if it's sent in the request headers
     if not token:
-        ls_token = request.headers.get("X-Auth-Token")
-        print(f"X-Auth-Token header: {ls_token}")
-        if ls_token:
+        token = headers.get("x-auth-token")
+        if token:
             # If X-Auth-Token has the Bearer prefix, remove it
-            if ls_token.startswith("Bearer "):
-                ls_token = ls_token[7:]  # Remove "Bearer " prefix
-            token = ls_token
-            print(f"Found token in X-Auth-Token header: {token[:10]}...")
+            if token.startswith("Bearer "):
+                token = token[7:]  # Remove "Bearer " prefix
+            logger.debug("Found token in X-Auth-Token header")
     
     # Set user in request state if token exists
     db = None
     if token:
         try:
-            db = next(get_db())
-            user = get_current_user(token=token, db=db)
-            request.state.user = user
-            print(f"Authenticated user: {user.username}, role: {user.role}")
+            # Share this session with the route's get_db dependency; objects survive
+            # the commit in load_request_user since sessions don't expire on commit
+            db = SessionLocal()
+            state.db = db
+            # Run the blocking user lookup off the event loop
+            user = await run_in_threadpool(load_request_user, db, token)
+            state.user = user
+            logger.debug("Authenticated user: %s, role: %s", user.username, user.role)
             
             # Also add the token to the request state for convenience
-            request.state.token = token
+            state.token = token
         except Exception as e:
-            print(f"Authentication error: {str(e)}")
-            # Continue without setting user
-            if db:
-                db.close()
+            logger.debug("Authentication error: %s", e)
+            # Continue without setting user; the session is closed below
     
     try:
         # Call the next middleware/route handler
@@ -577,16 +635,15 @@ async def get_user_middleware(request: Request, call_next):
         return response
     except Exception as e:
         # Log the error
-        print(f"Error in middleware chain: {str(e)}")
+        logger.exception("Error in middleware chain: %s", e)
         # Return a 500 error response
         return templates.TemplateResponse(
             "error.html",
             {
                 "request": request,
-                "user": getattr(request.state, "user", None),
+                "user": state.user,
                 "error": "An internal server error occurred.",
-                "status_code": 500,
-                "get_flash_messages": get_flash_messages
+                "status_code": 500
             },
             status_code=500
         )
@@ -595,6 +652,34 @@ async def get_user_middleware(request: Request, call_next):
         if db:
             db.close()
 
+class PageSessionMiddleware(SessionMiddleware):
+    """
+    Session middleware that skips cookie signing for static files, docs and the JSON API
+    """
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and SESSIONLESS_PATH_RE.match(scope["path"]):
+            # Error pages rendered for these paths still read request.session
+            scope["session"] = {}
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Sessions must be signed with the same key in every worker and across restarts
+SESSION_SECRET_KEY = os.environ.get("SESSION_SECRET_KEY")
+if not SESSION_SECRET_KEY:
+    raise RuntimeError("SESSION_SECRET_KEY environment variable is not set. Cannot start application securely.")
+
+# Add session middleware for flash messages and CSRF
+# Added last so that it wraps get_user_middleware, which reads request.session
+app.add_middleware(
+    PageSessionMiddleware,
+    secret_key=SESSION_SECRET_KEY,
+    session_cookie="session",
+    max_age=14 * 24 * 60 * 60,  # 14 days
+    same_site="lax",
+    https_only=False
+)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
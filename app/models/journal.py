@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Date, Text, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from datetime import date
 
@@ -8,59 +8,91 @@ from app.models.users import user_faculty, teacher_subject
 class Faculty(Base):
     __tablename__ = "faculties"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, index=True)
     
     # Relationships
-    users = relationship("User", secondary=user_faculty, back_populates="faculties")
-    groups = relationship("Group", back_populates="faculty")
-    subjects = relationship("Subject", back_populates="faculty")
+    users = relationship("User", secondary=user_faculty, back_populates="faculties", passive_deletes=True)
+    # Children are removed by the database's ON DELETE CASCADE, without loading them first
+    groups = relationship("Group", back_populates="faculty", cascade="all, delete", passive_deletes=True)
+    subjects = relationship("Subject", back_populates="faculty", cascade="all, delete", passive_deletes=True)
 
 class Group(Base):
     __tablename__ = "groups"
+    __table_args__ = (
+        # Journal URLs look groups up by name within a faculty; leading with
+        # faculty_id also serves the faculty filter and ON DELETE CASCADE
+        Index("ix_group_faculty_name", "faculty_id", "name", unique=True),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
-    faculty_id = Column(Integer, ForeignKey("faculties.id"))
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    faculty_id = Column(Integer, ForeignKey("faculties.id", ondelete="CASCADE"))
     
     # Relationships
     faculty = relationship("Faculty", back_populates="groups")
-    students = relationship("User", back_populates="group")
-    subject_groups = relationship("SubjectGroup", back_populates="group")
+    students = relationship("User", back_populates="group", passive_deletes=True)
+    subject_groups = relationship("SubjectGroup", back_populates="group", cascade="all, delete", passive_deletes=True)
 
 class Subject(Base):
     __tablename__ = "subjects"
+    __table_args__ = (
+        # Journal URLs look subjects up by name within a faculty; leading with
+        # faculty_id also serves the faculty filter and ON DELETE CASCADE
+        Index("ix_subject_faculty_name", "faculty_id", "name", unique=True),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     description = Column(Text, nullable=True)
     faculty_id = Column(Integer, ForeignKey("faculties.id", ondelete="CASCADE"), nullable=False)
     
     # Relationships
-    faculty = relationship("Faculty", back_populates="subjects")
-    subject_groups = relationship("SubjectGroup", back_populates="subject", cascade="all, delete-orphan")
-    teachers = relationship("User", secondary="teacher_subject", back_populates="subjects")
-    student_subjects = relationship("StudentSubject", foreign_keys="[StudentSubject.subject_id]", back_populates="subject")
+    # Never lazy-load the faculty; queries that need it join it explicitly
+    faculty = relationship("Faculty", back_populates="subjects", lazy="raise")
+    subject_groups = relationship("SubjectGroup", back_populates="subject", cascade="all, delete-orphan", passive_deletes=True)
+    teachers = relationship("User", secondary="teacher_subject", back_populates="subjects", passive_deletes=True)
+    student_subjects = relationship(
+        "StudentSubject", foreign_keys="[StudentSubject.subject_id]", back_populates="subject",
+        cascade="all, delete", passive_deletes=True
+    )
 
 class SubjectGroup(Base):
     __tablename__ = "subject_groups"
+    __table_args__ = (
+        Index("ix_sg_subject_group", "subject_id", "group_id", unique=True),
+        # Subject-groups of a group (group deletes cascade through this too)
+        Index("ix_sg_group", "group_id"),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    subject_id = Column(Integer, ForeignKey("subjects.id"))
-    group_id = Column(Integer, ForeignKey("groups.id"))
+    id = Column(Integer, primary_key=True)
+    subject_id = Column(Integer, ForeignKey("subjects.id", ondelete="CASCADE"))
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"))
     
     # Relationships
     subject = relationship("Subject", back_populates="subject_groups")
     group = relationship("Group", back_populates="subject_groups")
-    grades = relationship("Grade", back_populates="subject_group")
-    attendance = relationship("Attendance", back_populates="subject_group")
+    grades = relationship("Grade", back_populates="subject_group", cascade="all, delete", passive_deletes=True)
+    attendance = relationship("Attendance", back_populates="subject_group", cascade="all, delete", passive_deletes=True)
 
 class Grade(Base):
     __tablename__ = "grades"
+    __table_args__ = (
+        # Per-student gradebook lookups within a subject-group, ordered by date
+        Index("ix_grades_student_subject_date", "student_id", "subject_group_id", "date"),
+        # Whole-class journal view for a subject-group; on PostgreSQL the included columns
+        # let the journal read its (student, date, grade) rows with an index-only scan
+        Index(
+            "ix_grades_journal",
+            "subject_group_id",
+            "date",
+            postgresql_include=["student_id", "grade"]
+        ),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    student_id = Column(Integer, ForeignKey("users.id"))
-    subject_group_id = Column(Integer, ForeignKey("subject_groups.id"))
+    id = Column(Integer, primary_key=True)
+    student_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+    subject_group_id = Column(Integer, ForeignKey("subject_groups.id", ondelete="CASCADE"))
     grade = Column(Integer)
     date = Column(Date, default=date.today)
     description = Column(Text, nullable=True)
@@ -71,10 +103,21 @@ class Grade(Base):
 
 class Attendance(Base):
     __tablename__ = "attendance"
+    __table_args__ = (
+        # One record per student, subject-group and day; also serves per-student lookups by date
+        Index("ix_attendance_student_day", "student_id", "subject_group_id", "date", unique=True),
+        # Whole-class journal view for a subject-group, covering like ix_grades_journal
+        Index(
+            "ix_attendance_journal",
+            "subject_group_id",
+            "date",
+            postgresql_include=["student_id", "is_present"]
+        ),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    student_id = Column(Integer, ForeignKey("users.id"))
-    subject_group_id = Column(Integer, ForeignKey("subject_groups.id"))
+    id = Column(Integer, primary_key=True)
+    student_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+    subject_group_id = Column(Integer, ForeignKey("subject_groups.id", ondelete="CASCADE"))
     date = Column(Date, default=date.today)
     is_present = Column(Boolean, default=True)
     
@@ -84,8 +127,13 @@ class Attendance(Base):
 
 class StudentSubject(Base):
     __tablename__ = "student_subjects"
+    __table_args__ = (
+        # A student is enrolled in a subject once; subject deletes cascade by subject_id
+        Index("ix_student_subjects_pair", "student_id", "subject_id", unique=True),
+        Index("ix_student_subjects_subject", "subject_id"),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     student_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     subject_id = Column(Integer, ForeignKey("subjects.id", ondelete="CASCADE"), nullable=False)
     
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean, Enum, ForeignKey, Table
+from sqlalchemy import Column, Integer, SmallInteger, String, Boolean, ForeignKey, Table, Index
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import relationship
 import enum
 
@@ -9,49 +10,95 @@ class UserRole(enum.Enum):
     TEACHER = "teacher"
     STUDENT = "student"
 
+# Roles are stored as small integer codes instead of a PostgreSQL enum of names
+ROLE_CODES = {UserRole.ADMIN: 1, UserRole.TEACHER: 2, UserRole.STUDENT: 3}
+ROLES_BY_CODE = {code: role for role, code in ROLE_CODES.items()}
+
+class RoleCode(TypeDecorator):
+    """
+    Map UserRole to its SMALLINT code in the database and back
+    """
+    impl = SmallInteger
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return ROLE_CODES[UserRole(value)]
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return ROLES_BY_CODE[value]
+
 # Many-to-many relationship between users and faculties (for teachers and admins)
 user_faculty = Table(
     "user_faculty",
     Base.metadata,
-    Column("user_id", Integer, ForeignKey("users.id")),
-    Column("faculty_id", Integer, ForeignKey("faculties.id"))
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE")),
+    Column("faculty_id", Integer, ForeignKey("faculties.id", ondelete="CASCADE"))
 )
 
 # Many-to-many relationship between teachers and subjects
 teacher_subject = Table(
     "teacher_subject",
     Base.metadata,
-    Column("user_id", Integer, ForeignKey("users.id")),
-    Column("subject_id", Integer, ForeignKey("subjects.id"))
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE")),
+    Column("subject_id", Integer, ForeignKey("subjects.id", ondelete="CASCADE")),
+    # One row per teacher and subject; lets assignments skip duplicates with ON CONFLICT
+    Index("ix_teacher_subject_pair", "user_id", "subject_id", unique=True)
 )
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Enforces unique usernames and lets the login lookup be answered by an index-only scan on PostgreSQL
+        Index(
+            "ix_users_username_login",
+            "username",
+            unique=True,
+            postgresql_include=["id", "hashed_password", "role", "is_active", "is_verified", "full_name", "email", "group_id"]
+        ),
+        # Students of a group (journal views, the group delete check and its SET NULL cascade);
+        # on PostgreSQL the journal's student list is answered by an index-only scan
+        Index(
+            "ix_users_group_students",
+            "group_id",
+            "role",
+            postgresql_include=["is_active", "is_verified", "full_name", "username"]
+        ),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, unique=True, index=True)
+    id = Column(Integer, primary_key=True)
+    username = Column(String)
     email = Column(String, unique=True, index=True)
     full_name = Column(String)
     hashed_password = Column(String)
-    role = Column(Enum(UserRole))
+    role = Column(RoleCode)
     is_active = Column(Boolean, default=True)
     is_verified = Column(Boolean, default=False)
     
     # Relationships
-    faculties = relationship("Faculty", secondary=user_faculty, back_populates="users")
+    # passive_deletes leaves dependent rows to the foreign keys' ON DELETE rules,
+    # so deleting a user doesn't load every related collection first
+    faculties = relationship("Faculty", secondary=user_faculty, back_populates="users", passive_deletes=True)
     
     # Teacher-specific relationships
-    subjects = relationship("Subject", secondary=teacher_subject, back_populates="teachers")
+    subjects = relationship("Subject", secondary=teacher_subject, back_populates="teachers", passive_deletes=True)
     
     # Student-specific relationships
-    group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
+    # Deleting a group (directly or with its faculty) leaves its students without a group
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="SET NULL"), nullable=True)
     group = relationship("Group", back_populates="students")
     
     # One-to-many relationship with grades (for students)
-    grades = relationship("Grade", back_populates="student")
+    grades = relationship("Grade", back_populates="student", passive_deletes=True)
     
     # One-to-many relationship with attendance (for students)
-    attendance = relationship("Attendance", back_populates="student")
+    attendance = relationship("Attendance", back_populates="student", passive_deletes=True)
     
     # Student-specific relationships
-    student_subjects = relationship("StudentSubject", foreign_keys="[StudentSubject.student_id]", back_populates="student") 
\ No newline at end of file
+    student_subjects = relationship(
+        "StudentSubject", foreign_keys="[StudentSubject.student_id]", back_populates="student",
+        cascade="all, delete", passive_deletes=True
+    ) 
\ No newline at end of file
@@ -2,17 +2,28 @@ from fastapi import APIRouter, Depends, status, Response, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 from typing import Optional
+import threading
+
+from cachetools import TTLCache
 
 from app.database.connection import get_db
 from app.models import User, UserRole
-from app.schemas import UserCreate, UserLogin, Token, UserDisplay
+from app.schemas import UserCreate, UserLogin, Token, UserDisplay, UserLoginResponse
 from app.services import register_user, login_user
-from app.auth.jwt import get_current_user_optional
+from app.auth.jwt import get_current_user_optional, revoke_token
+from app.templating import templates
 
 router = APIRouter(tags=["Authentication"])
-templates = Jinja2Templates(directory="app/templates")
+
+# Rendered anonymous login page per base URL, with the session's CSRF token swapped for a marker
+_login_page_cache = TTLCache(maxsize=16, ttl=300)
+_login_page_cache_lock = threading.Lock()
+_CSRF_MARKER = b"__CSRF_TOKEN__"
+
+# Login cookie: readable by JavaScript (no HttpOnly), sent on cross-site navigation (SameSite=lax),
+# allowed over plain HTTP for local development (no Secure), valid for all paths
+_ACCESS_TOKEN_COOKIE = 'access_token="Bearer {token}"; Max-Age=1800; Path=/; SameSite=lax'
 
 @router.get("/login", response_class=HTMLResponse)
 def login_page(request: Request, current_user: Optional[User] = Depends(get_current_user_optional)):
@@ -21,11 +32,28 @@ def login_page(request: Request, current_user: Optional[User] = Depends(get_curr
     """
     if current_user:
         return RedirectResponse("/", status_code=status.HTTP_303_SEE_OTHER)
-        
-    return templates.TemplateResponse(
+    
+    # The page only differs between visitors by CSRF token, unless flash messages are pending
+    csrf_token = request.session.get("csrf_token")
+    cacheable = bool(csrf_token) and not request.session.get("flash_messages")
+    base_url = str(request.base_url)
+    
+    if cacheable:
+        with _login_page_cache_lock:
+            cached = _login_page_cache.get(base_url)
+        if cached is not None:
+            return HTMLResponse(cached.replace(_CSRF_MARKER, csrf_token.encode()))
+    
+    response = templates.TemplateResponse(
         "login.html", 
         {"request": request, "user": None}
     )
+    
+    if cacheable:
+        with _login_page_cache_lock:
+            _login_page_cache[base_url] = response.body.replace(csrf_token.encode(), _CSRF_MARKER)
+    
+    return response
 
 @router.post("/register", response_model=UserDisplay, status_code=status.HTTP_201_CREATED)
 def register(user: UserCreate, db: Session = Depends(get_db)):
@@ -46,48 +74,33 @@ def get_token(
     result = login_user(db, user)
     return Token(access_token=result["access_token"], token_type=result["token_type"])
 
-@router.post("/login")
+@router.post("/login", response_model=UserLoginResponse)
 def login(user: UserLogin, response: Response, db: Session = Depends(get_db)):
     """
     Login and get an access token
     """
     result = login_user(db, user)
     
-    # Set the token in a cookie (optional)
-    response.set_cookie(
-        key="access_token",
-        value=f"Bearer {result['access_token']}",
-        httponly=False,  # Allow JavaScript access
-        max_age=1800,
-        expires=1800,
-        samesite="lax",  # Allow cookie to be sent for cross-site navigation
-        secure=False,  # No HTTPS required for local development
-        path="/"  # Set cookie for all paths
+    # Set the token in a cookie (optional); only the token varies, so append a prebuilt header
+    response.raw_headers.append(
+        (b"set-cookie", _ACCESS_TOKEN_COOKIE.format(token=result["access_token"]).encode("latin-1"))
     )
     
-    # Get the user data
-    db_user = result["user"]
-    
     # Return the token and user data
-    return {
-        "access_token": result["access_token"],
-        "token_type": result["token_type"],
-        "user": {
-            "id": db_user.id,
-            "username": db_user.username,
-            "full_name": db_user.full_name,
-            "email": db_user.email,
-            "role": db_user.role.value,
-            "is_verified": db_user.is_verified,
-            "group_id": db_user.group_id,
-            "is_active": db_user.is_active
-        }
-    }
+    return UserLoginResponse(
+        access_token=result["access_token"],
+        token_type=result["token_type"],
+        user=UserDisplay.model_validate(result["user"])
+    )
 
 @router.post("/logout")
-def logout(response: Response):
+async def logout(request: Request, response: Response):
     """
-    Logout by clearing the cookie
+    Logout by revoking the current token and clearing the cookie
     """
+    # The user middleware stores the token it authenticated this request with
+    if request.state.token:
+        revoke_token(request.state.token)
+    
     response.delete_cookie(key="access_token")
     return {"message": "Successfully logged out"} 
\ No newline at end of file
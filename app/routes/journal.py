@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from sqlalchemy import and_
-import urllib.parse
+from datetime import date
+from sqlalchemy import and_, delete
+from sqlalchemy.exc import IntegrityError
+import logging
 
+from app.cache import LoadingCache
 from app.database.connection import get_db
 from app.models import User, UserRole, Group, Subject, SubjectGroup, Grade, Attendance, Faculty, StudentSubject
+from app.models.users import teacher_subject
 from app.schemas import (
     FacultyCreate, FacultyDisplay,
     GroupCreate, GroupDisplay,
@@ -13,7 +17,8 @@ from app.schemas import (
     SubjectGroupCreate, SubjectGroupDisplay,
     GradeCreate, GradeUpdate, GradeDisplay,
     AttendanceCreate, AttendanceUpdate, AttendanceDisplay,
-    JournalView, StudentSubjectCreate, StudentSubjectDisplay
+    JournalView, StudentSubjectCreate, StudentSubjectDisplay,
+    StudentSubjectCreateResponse
 )
 from app.services import (
     create_faculty, get_faculties, get_faculty_by_id,
@@ -22,42 +27,122 @@ from app.services import (
     create_subject_group, get_subject_groups, get_subject_group_by_id,
     create_grade, get_grades, update_grade,
     create_attendance, get_attendance, update_attendance,
-    get_journal_view, assign_subject_to_teacher, remove_subject_from_teacher,
-    get_teacher_subjects
+    create_grades_bulk, create_attendance_bulk,
+    assign_subject_to_teacher, remove_subject_from_teacher,
+    get_teacher_subjects, clear_user_list_cache, get_cached_journal_view, clear_journal_cache
 )
-from app.auth.jwt import get_current_verified_user
+from app.auth.jwt import get_current_verified_user, get_current_teacher_or_admin, get_current_admin, get_teacher_subject_ids
+from app.templating import journal_url
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["Journal"], prefix="/api/journal")
 
+# The registration form's faculty and group lists change rarely, so each worker keeps them
+# for a few minutes; local creates and deletes clear the cache right away
+_public_list_cache = LoadingCache(maxsize=256, ttl=300)
+
+def cached_public_list(key: tuple, load):
+    """
+    Return the cached public list for key, loading and caching it on a miss
+    """
+    return _public_list_cache.get_or_load(key, load)
+
+def clear_public_list_cache() -> None:
+    """
+    Drop the cached public lists after faculties or groups change
+    """
+    _public_list_cache.clear()
+
+# Write checks read teacher_subject directly instead of the token's subject claims,
+# so removing a subject from a teacher takes away write access immediately
+def check_teacher_subject_groups(db: Session, teacher: User, subject_group_ids: set) -> None:
+    """
+    Raise 403 unless the teacher is assigned to the subject of every given subject-group
+    """
+    unassigned = db.query(SubjectGroup.id).outerjoin(
+        teacher_subject,
+        and_(teacher_subject.c.subject_id == SubjectGroup.subject_id, teacher_subject.c.user_id == teacher.id)
+    ).filter(
+        SubjectGroup.id.in_(subject_group_ids),
+        teacher_subject.c.user_id.is_(None)
+    ).first()
+    if unassigned is not None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this subject"
+        )
+
+def check_teacher_subject_group(db: Session, teacher: User, subject_group_id: int) -> None:
+    """
+    Raise 404 if the subject-group doesn't exist, or 403 unless the teacher is assigned to its subject
+    """
+    row = db.query(SubjectGroup.id, teacher_subject.c.user_id).outerjoin(
+        teacher_subject,
+        and_(teacher_subject.c.subject_id == SubjectGroup.subject_id, teacher_subject.c.user_id == teacher.id)
+    ).filter(SubjectGroup.id == subject_group_id).first()
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Subject-group relationship with ID {subject_group_id} not found"
+        )
+    if row.user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this subject"
+        )
+
+def get_editable_record(db: Session, model, record_id: int, user: User, label: str):
+    """
+    Load a grade or attendance record together with whether the user teaches its subject in one query,
+    raising 404 if it doesn't exist or 403 if a teacher isn't assigned to the subject
+    """
+    row = db.query(model, teacher_subject.c.user_id).outerjoin(
+        SubjectGroup, SubjectGroup.id == model.subject_group_id
+    ).outerjoin(
+        teacher_subject,
+        and_(teacher_subject.c.subject_id == SubjectGroup.subject_id, teacher_subject.c.user_id == user.id)
+    ).filter(model.id == record_id).first()
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"{label} with ID {record_id} not found"
+        )
+    
+    record, assigned_teacher_id = row
+    if user.role == UserRole.TEACHER and assigned_teacher_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this subject"
+        )
+    return record
+
 # Faculty routes
 @router.post("/faculties", response_model=FacultyDisplay, status_code=status.HTTP_201_CREATED)
 def create_faculty_endpoint(
     faculty: FacultyCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Create a new faculty (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
-    return create_faculty(db, faculty)
+    db_faculty = create_faculty(db, faculty)
+    clear_public_list_cache()
+    return db_faculty
 
 @router.get("/faculties", response_model=List[FacultyDisplay])
 def read_faculties(
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=500),
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_verified_user)
 ):
     """
     Get a list of faculties
     """
-    return get_faculties(db, skip=skip, limit=limit)
+    return get_faculties(db, skip=skip, limit=limit, after_id=after_id)
 
 @router.get("/faculties/{faculty_id}", response_model=FacultyDisplay)
 def read_faculty(
@@ -74,58 +159,23 @@ def read_faculty(
 def delete_faculty_endpoint(
     faculty_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Delete a faculty (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
+    # Delete the faculty in one statement; its groups, subjects, subject-groups,
+    # grades and attendance are removed by the database's ON DELETE CASCADE rules
+    result = db.execute(delete(Faculty).where(Faculty.id == faculty_id))
+    if result.rowcount == 0:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Faculty with ID {faculty_id} not found"
         )
-    
-    # Get the faculty to check if it exists
-    faculty = get_faculty_by_id(db, faculty_id)
-    
-    # Delete all associated groups
-    groups = db.query(Group).filter(Group.faculty_id == faculty_id).all()
-    for group in groups:
-        # Delete all subject-group relationships for this group
-        subject_groups = db.query(SubjectGroup).filter(SubjectGroup.group_id == group.id).all()
-        for subject_group in subject_groups:
-            # Delete all grades and attendance records for this subject-group
-            db.query(Grade).filter(Grade.subject_group_id == subject_group.id).delete()
-            db.query(Attendance).filter(Attendance.subject_group_id == subject_group.id).delete()
-            
-            # Delete the subject-group relationship
-            db.delete(subject_group)
-        
-        # Delete the group
-        db.delete(group)
-    
-    # Delete all associated subjects
-    subjects = db.query(Subject).filter(Subject.faculty_id == faculty_id).all()
-    for subject in subjects:
-        # Delete all student-subject relationships for this subject
-        db.query(StudentSubject).filter(StudentSubject.subject_id == subject.id).delete()
-        
-        # Delete all subject-group relationships for this subject
-        subject_groups = db.query(SubjectGroup).filter(SubjectGroup.subject_id == subject.id).all()
-        for subject_group in subject_groups:
-            # Delete all grades and attendance records for this subject-group
-            db.query(Grade).filter(Grade.subject_group_id == subject_group.id).delete()
-            db.query(Attendance).filter(Attendance.subject_group_id == subject_group.id).delete()
-            
-            # Delete the subject-group relationship
-            db.delete(subject_group)
-        
-        # Delete the subject
-        db.delete(subject)
-    
-    # Delete the faculty
-    db.delete(faculty)
     db.commit()
+    clear_public_list_cache()
+    # Students of the deleted groups lost their group_id
+    clear_user_list_cache()
     
     return None
 
@@ -139,38 +189,38 @@ def read_public_faculties(
     """
     Get a list of faculties without authentication (for registration)
     """
-    return get_faculties(db, skip=skip, limit=limit)
+    return cached_public_list(
+        ("faculties", skip, limit),
+        lambda: [FacultyDisplay.model_validate(faculty) for faculty in get_faculties(db, skip=skip, limit=limit)]
+    )
 
 # Group routes
 @router.post("/groups", response_model=GroupDisplay, status_code=status.HTTP_201_CREATED)
 def create_group_endpoint(
     group: GroupCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Create a new group (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
-    return create_group(db, group)
+    db_group = create_group(db, group)
+    clear_public_list_cache()
+    return db_group
 
 @router.get("/groups", response_model=List[GroupDisplay])
 def read_groups(
     faculty_id: Optional[int] = None,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=500),
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_verified_user)
 ):
     """
     Get a list of groups, optionally filtered by faculty
     """
-    return get_groups(db, faculty_id=faculty_id, skip=skip, limit=limit)
+    return get_groups(db, faculty_id=faculty_id, skip=skip, limit=limit, after_id=after_id)
 
 @router.get("/groups/{group_id}", response_model=GroupDisplay)
 def read_group(
@@ -187,45 +237,36 @@ def read_group(
 def delete_group_endpoint(
     group_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Delete a group (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
+    # Lock the group row until commit; on PostgreSQL this also blocks students from being
+    # assigned to it (their foreign key check needs a share lock) between the check and the delete
+    locked_group_id = db.query(Group.id).filter(Group.id == group_id).with_for_update().scalar()
+    if locked_group_id is None:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Group with ID {group_id} not found"
         )
     
-    # Get the group to check if it exists
-    group = get_group_by_id(db, group_id)
-    
-    # Check if any students are in this group
-    students_in_group = db.query(User).filter(
-        User.group_id == group_id, 
-        User.role == UserRole.STUDENT
-    ).count()
+    # Check if any students are in this group; EXISTS stops at the first match
+    has_students = db.query(
+        db.query(User).filter(User.group_id == group_id, User.role == UserRole.STUDENT).exists()
+    ).scalar()
     
-    if students_in_group > 0:
+    if has_students:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Cannot delete group with ID {group_id} because it has students assigned to it"
         )
     
-    # Delete all subject-group relationships for this group
-    subject_groups = db.query(SubjectGroup).filter(SubjectGroup.group_id == group_id).all()
-    for subject_group in subject_groups:
-        # Delete all grades and attendance records for this subject-group
-        db.query(Grade).filter(Grade.subject_group_id == subject_group.id).delete()
-        db.query(Attendance).filter(Attendance.subject_group_id == subject_group.id).delete()
-        
-        # Delete the subject-group relationship
-        db.delete(subject_group)
-    
-    # Delete the group
-    db.delete(group)
+    # Delete the group in one statement; subject-groups with their grades
+    # and attendance are removed by ON DELETE CASCADE
+    db.execute(delete(Group).where(Group.id == group_id))
     db.commit()
+    clear_public_list_cache()
     
     return None
 
@@ -240,45 +281,41 @@ def read_public_groups(
     """
     Get a list of groups without authentication (for registration)
     """
-    return get_groups(db, faculty_id=faculty_id, skip=skip, limit=limit)
+    return cached_public_list(
+        ("groups", faculty_id, skip, limit),
+        lambda: [GroupDisplay.model_validate(group) for group in get_groups(db, faculty_id=faculty_id, skip=skip, limit=limit)]
+    )
 
 # Subject routes
 @router.post("/subjects", response_model=SubjectDisplay, status_code=status.HTTP_201_CREATED)
 def create_subject_endpoint(
     subject: SubjectCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Create a new subject (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
     return create_subject(db, subject)
 
 @router.get("/subjects", response_model=List[SubjectDisplay])
 def read_subjects(
     faculty_id: Optional[int] = None,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=500),
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_verified_user)
 ):
     """
     Get a list of subjects, optionally filtered by faculty
     """
-    # For teachers, only return subjects they have access to
-    if current_user.role == UserRole.TEACHER:
-        teacher_subjects = current_user.subjects
-        if faculty_id:
-            return [s for s in teacher_subjects if s.faculty_id == faculty_id]
-        return teacher_subjects
-        
-    return get_subjects(db, faculty_id=faculty_id, skip=skip, limit=limit)
+    # For teachers, only return subjects they have access to; filtered and paged in SQL
+    teacher_id = current_user.id if current_user.role == UserRole.TEACHER else None
+    
+    return get_subjects(
+        db, faculty_id=faculty_id, skip=skip, limit=limit, teacher_id=teacher_id, after_id=after_id
+    )
 
 @router.get("/subjects/{subject_id}", response_model=SubjectDisplay)
 def read_subject(
@@ -291,7 +328,7 @@ def read_subject(
     """
     # For teachers, check if they have access to this subject
     if current_user.role == UserRole.TEACHER:
-        teacher_subjects = [s.id for s in current_user.subjects]
+        teacher_subjects = get_teacher_subject_ids(db, current_user)
         if subject_id not in teacher_subjects:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -304,35 +341,19 @@ def read_subject(
 def delete_subject_endpoint(
     subject_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Delete a subject (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
+    # Delete the subject in one statement; teacher assignments, student-subjects
+    # and subject-groups with their grades and attendance are removed by ON DELETE CASCADE
+    result = db.execute(delete(Subject).where(Subject.id == subject_id))
+    if result.rowcount == 0:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Subject with ID {subject_id} not found"
         )
-    
-    # Get the subject to check if it exists
-    subject = get_subject_by_id(db, subject_id)
-    
-    # Delete all student-subject relationships for this subject
-    db.query(StudentSubject).filter(StudentSubject.subject_id == subject_id).delete()
-    
-    # Delete all subject-group relationships for this subject
-    subject_groups = db.query(SubjectGroup).filter(SubjectGroup.subject_id == subject_id).all()
-    for subject_group in subject_groups:
-        # Delete all grades and attendance records for this subject-group
-        db.query(Grade).filter(Grade.subject_group_id == subject_group.id).delete()
-        db.query(Attendance).filter(Attendance.subject_group_id == subject_group.id).delete()
-        
-        # Delete the subject-group relationship
-        db.delete(subject_group)
-    
-    # Delete the subject
-    db.delete(subject)
     db.commit()
     
     return None
@@ -342,17 +363,11 @@ def delete_subject_endpoint(
 def create_subject_group_endpoint(
     subject_group: SubjectGroupCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Create a new subject-group relationship (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
     return create_subject_group(db, subject_group)
 
 @router.get("/subject-groups", response_model=List[SubjectGroupDisplay])
@@ -360,14 +375,17 @@ def read_subject_groups(
     subject_id: Optional[int] = None,
     group_id: Optional[int] = None,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=500),
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_verified_user)
 ):
     """
     Get a list of subject-group relationships, optionally filtered by subject or group
     """
-    return get_subject_groups(db, subject_id=subject_id, group_id=group_id, skip=skip, limit=limit)
+    return get_subject_groups(
+        db, subject_id=subject_id, group_id=group_id, skip=skip, limit=limit, after_id=after_id
+    )
 
 @router.get("/subject-groups/{subject_group_id}", response_model=SubjectGroupDisplay)
 def read_subject_group(
@@ -384,27 +402,21 @@ def read_subject_group(
 def delete_subject_group_endpoint(
     subject_group_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Delete a subject-group relationship (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
+    # Delete the subject-group relationship in one statement; grades and
+    # attendance records are removed by ON DELETE CASCADE
+    result = db.execute(delete(SubjectGroup).where(SubjectGroup.id == subject_group_id))
+    if result.rowcount == 0:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Subject-group relationship with ID {subject_group_id} not found"
         )
-    
-    # Get the subject-group to check if it exists
-    subject_group = get_subject_group_by_id(db, subject_group_id)
-    
-    # Delete all grades and attendance records for this subject-group
-    db.query(Grade).filter(Grade.subject_group_id == subject_group_id).delete()
-    db.query(Attendance).filter(Attendance.subject_group_id == subject_group_id).delete()
-    
-    # Delete the subject-group relationship
-    db.delete(subject_group)
     db.commit()
+    clear_journal_cache()
     
     return None
 
@@ -413,90 +425,68 @@ def delete_subject_group_endpoint(
 def create_grade_endpoint(
     grade: GradeCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_teacher_or_admin)
 ):
     """
     Create a new grade (teachers only)
     """
-    if current_user.role != UserRole.TEACHER and current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
     # Check if the teacher has access to the subject
     if current_user.role == UserRole.TEACHER:
-        # Get the subject_group to find the subject
-        subject_group = get_subject_group_by_id(db, grade.subject_group_id)
-        
-        # Get teacher's assigned subjects
-        teacher_subject_ids = [s.id for s in current_user.subjects]
-        
-        # Check if teacher has access to this subject
-        if subject_group.subject_id not in teacher_subject_ids:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You don't have access to this subject"
-            )
+        check_teacher_subject_group(db, current_user, grade.subject_group_id)
     
     return create_grade(db, grade)
 
+@router.post("/grades/bulk", status_code=status.HTTP_201_CREATED)
+def create_grades_bulk_endpoint(
+    grades: List[GradeCreate],
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_teacher_or_admin)
+):
+    """
+    Create many grades at once, e.g. for a whole class (teachers only)
+    """
+    # Check if the teacher has access to every subject in the payload
+    if current_user.role == UserRole.TEACHER:
+        check_teacher_subject_groups(db, current_user, {grade.subject_group_id for grade in grades})
+    
+    return {"created": create_grades_bulk(db, grades)}
+
 @router.get("/grades", response_model=List[GradeDisplay])
 def read_grades(
     student_id: Optional[int] = None,
     subject_group_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=500),
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_verified_user)
 ):
     """
-    Get a list of grades, optionally filtered by student or subject-group
+    Get a list of grades, optionally filtered by student, subject-group or date range
     """
     # Students can only see their own grades
     if current_user.role == UserRole.STUDENT:
         student_id = current_user.id
     
-    return get_grades(db, student_id=student_id, subject_group_id=subject_group_id, skip=skip, limit=limit)
+    return get_grades(
+        db, student_id=student_id, subject_group_id=subject_group_id,
+        date_from=date_from, date_to=date_to, skip=skip, limit=limit, after_id=after_id
+    )
 
 @router.put("/grades/{grade_id}", response_model=GradeDisplay)
 def update_grade_endpoint(
     grade_id: int,
     grade_data: GradeUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_teacher_or_admin)
 ):
     """
     Update a grade (teachers only)
     """
-    if current_user.role != UserRole.TEACHER and current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
-    # Fetch the grade to check subject access
-    existing_grade = db.query(Grade).filter(Grade.id == grade_id).first()
-    if not existing_grade:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Grade with ID {grade_id} not found"
-        )
-    
-    # Check if the teacher has access to the subject
-    if current_user.role == UserRole.TEACHER:
-        # Get the subject_group to find the subject
-        subject_group = get_subject_group_by_id(db, existing_grade.subject_group_id)
-        
-        # Get teacher's assigned subjects
-        teacher_subject_ids = [s.id for s in current_user.subjects]
-        
-        # Check if teacher has access to this subject
-        if subject_group.subject_id not in teacher_subject_ids:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You don't have access to this subject"
-            )
+    # Check that the grade exists and the teacher has access to its subject
+    get_editable_record(db, Grade, grade_id, current_user, "Grade")
     
     return update_grade(db, grade_id, grade_data)
 
@@ -504,43 +494,18 @@ def update_grade_endpoint(
 def delete_grade_endpoint(
     grade_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_teacher_or_admin)
 ):
     """
     Delete a grade (teachers only)
     """
-    if current_user.role != UserRole.TEACHER and current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
     # Get the grade to check if it exists and if teacher has access
-    grade = db.query(Grade).filter(Grade.id == grade_id).first()
-    if not grade:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Grade with ID {grade_id} not found"
-        )
-    
-    # Check if the teacher has access to the subject
-    if current_user.role == UserRole.TEACHER:
-        # Get the subject_group to find the subject
-        subject_group = get_subject_group_by_id(db, grade.subject_group_id)
-        
-        # Get teacher's assigned subjects
-        teacher_subject_ids = [s.id for s in current_user.subjects]
-        
-        # Check if teacher has access to this subject
-        if subject_group.subject_id not in teacher_subject_ids:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You don't have access to this subject"
-            )
+    grade = get_editable_record(db, Grade, grade_id, current_user, "Grade")
     
     # Delete the grade
     db.delete(grade)
     db.commit()
+    clear_journal_cache()
     
     return None
 
@@ -549,90 +514,68 @@ def delete_grade_endpoint(
 def create_attendance_endpoint(
     attendance: AttendanceCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_teacher_or_admin)
 ):
     """
     Create a new attendance record (teachers only)
     """
-    if current_user.role != UserRole.TEACHER and current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
     # Check if the teacher has access to the subject
     if current_user.role == UserRole.TEACHER:
-        # Get the subject_group to find the subject
-        subject_group = get_subject_group_by_id(db, attendance.subject_group_id)
-        
-        # Get teacher's assigned subjects
-        teacher_subject_ids = [s.id for s in current_user.subjects]
-        
-        # Check if teacher has access to this subject
-        if subject_group.subject_id not in teacher_subject_ids:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You don't have access to this subject"
-            )
+        check_teacher_subject_group(db, current_user, attendance.subject_group_id)
     
     return create_attendance(db, attendance)
 
+@router.post("/attendance/bulk", status_code=status.HTTP_201_CREATED)
+def create_attendance_bulk_endpoint(
+    records: List[AttendanceCreate],
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_teacher_or_admin)
+):
+    """
+    Create many attendance records at once, e.g. for a whole class (teachers only)
+    """
+    # Check if the teacher has access to every subject in the payload
+    if current_user.role == UserRole.TEACHER:
+        check_teacher_subject_groups(db, current_user, {record.subject_group_id for record in records})
+    
+    return {"created": create_attendance_bulk(db, records)}
+
 @router.get("/attendance", response_model=List[AttendanceDisplay])
 def read_attendance_records(
     student_id: Optional[int] = None,
     subject_group_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=500),
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_verified_user)
 ):
     """
-    Get a list of attendance records, optionally filtered by student or subject-group
+    Get a list of attendance records, optionally filtered by student, subject-group or date range
     """
     # Students can only see their own attendance
     if current_user.role == UserRole.STUDENT:
         student_id = current_user.id
     
-    return get_attendance(db, student_id=student_id, subject_group_id=subject_group_id, skip=skip, limit=limit)
+    return get_attendance(
+        db, student_id=student_id, subject_group_id=subject_group_id,
+        date_from=date_from, date_to=date_to, skip=skip, limit=limit, after_id=after_id
+    )
 
 @router.put("/attendance/{attendance_id}", response_model=AttendanceDisplay)
 def update_attendance_endpoint(
     attendance_id: int,
     attendance_data: AttendanceUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_teacher_or_admin)
 ):
     """
     Update an attendance record (teachers only)
     """
-    if current_user.role != UserRole.TEACHER and current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
-    # Fetch the attendance record to check subject access
-    existing_attendance = db.query(Attendance).filter(Attendance.id == attendance_id).first()
-    if not existing_attendance:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Attendance record with ID {attendance_id} not found"
-        )
-    
-    # Check if the teacher has access to the subject
-    if current_user.role == UserRole.TEACHER:
-        # Get the subject_group to find the subject
-        subject_group = get_subject_group_by_id(db, existing_attendance.subject_group_id)
-        
-        # Get teacher's assigned subjects
-        teacher_subject_ids = [s.id for s in current_user.subjects]
-        
-        # Check if teacher has access to this subject
-        if subject_group.subject_id not in teacher_subject_ids:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You don't have access to this subject"
-            )
+    # Check that the record exists and the teacher has access to its subject
+    get_editable_record(db, Attendance, attendance_id, current_user, "Attendance record")
     
     return update_attendance(db, attendance_id, attendance_data)
 
@@ -640,43 +583,18 @@ def update_attendance_endpoint(
 def delete_attendance_endpoint(
     attendance_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_teacher_or_admin)
 ):
     """
     Delete an attendance record (teachers only)
     """
-    if current_user.role != UserRole.TEACHER and current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
     # Get the attendance record to check if it exists and if teacher has access
-    attendance = db.query(Attendance).filter(Attendance.id == attendance_id).first()
-    if not attendance:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Attendance record with ID {attendance_id} not found"
-        )
-    
-    # Check if the teacher has access to the subject
-    if current_user.role == UserRole.TEACHER:
-        # Get the subject_group to find the subject
-        subject_group = get_subject_group_by_id(db, attendance.subject_group_id)
-        
-        # Get teacher's assigned subjects
-        teacher_subject_ids = [s.id for s in current_user.subjects]
-        
-        # Check if teacher has access to this subject
-        if subject_group.subject_id not in teacher_subject_ids:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="You don't have access to this subject"
-            )
+    attendance = get_editable_record(db, Attendance, attendance_id, current_user, "Attendance record")
     
     # Delete the attendance record
     db.delete(attendance)
     db.commit()
+    clear_journal_cache()
     
     return None
 
@@ -686,81 +604,84 @@ def read_journal(
     faculty: str,
     group: str,
     subject: str,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_verified_user)
 ):
     """
     Get a structured view of the journal for a specific faculty, group, and subject
     """
-    # Get the faculty, group, and subject by name
-    db_faculty = db.query(Faculty).filter(Faculty.name == faculty).first()
-    if not db_faculty:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Faculty '{faculty}' not found"
-        )
+    # Resolve the faculty, group, and subject ids by name in one query
+    row = db.query(Group.id, Subject.id).select_from(Faculty).join(
+        Group, and_(Group.faculty_id == Faculty.id, Group.name == group)
+    ).join(
+        Subject, and_(Subject.faculty_id == Faculty.id, Subject.name == subject)
+    ).filter(
+        Faculty.name == faculty
+    ).first()
     
-    db_group = db.query(Group).filter(Group.name == group, Group.faculty_id == db_faculty.id).first()
-    if not db_group:
+    if row is None:
+        # Not found - look the parts up one by one to report which one is missing
+        db_faculty = db.query(Faculty.id).filter(Faculty.name == faculty).first()
+        if not db_faculty:
+            detail = f"Faculty '{faculty}' not found"
+        elif not db.query(Group.id).filter(Group.name == group, Group.faculty_id == db_faculty.id).first():
+            detail = f"Group '{group}' not found in faculty '{faculty}'"
+        else:
+            detail = f"Subject '{subject}' not found in faculty '{faculty}'"
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Group '{group}' not found in faculty '{faculty}'"
+            detail=detail
         )
     
-    db_subject = db.query(Subject).filter(Subject.name == subject, Subject.faculty_id == db_faculty.id).first()
-    if not db_subject:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Subject '{subject}' not found in faculty '{faculty}'"
-        )
+    group_id, subject_id = row
     
     # Check permissions
     if current_user.role == UserRole.STUDENT:
         # Students can only view journals for their own group
-        if current_user.group_id != db_group.id:
+        if current_user.group_id != group_id:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Not enough permissions"
             )
     elif current_user.role == UserRole.TEACHER:
         # Teachers can only view journals for subjects they teach
-        teacher_subjects = [s.id for s in current_user.subjects]
-        if db_subject.id not in teacher_subjects:
+        teacher_subjects = get_teacher_subject_ids(db, current_user)
+        if subject_id not in teacher_subjects:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You don't have access to this subject"
             )
     
-    return get_journal_view(db, db_subject.id, db_group.id)
+    etag, body = get_cached_journal_view(db, subject_id, group_id)
+    
+    # Conditional GET: the client's copy is still current, so skip the body
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    
+    # Send the cached JSON as is instead of validating and encoding the model again;
+    # browsers must revalidate, but an unchanged journal then costs only the 304
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"}
+    )
 
 # Teacher-Subject routes
 @router.get("/teacher-subjects", response_model=List[dict])
 def read_all_teacher_subjects(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Get a list of all teacher-subject relationships (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
-    # Get all teachers
-    teachers = db.query(User).filter(User.role == UserRole.TEACHER).all()
+    # Read all teacher-subject pairs straight from the association table
+    rows = db.query(teacher_subject.c.user_id, teacher_subject.c.subject_id).join(
+        User, User.id == teacher_subject.c.user_id
+    ).filter(User.role == UserRole.TEACHER).all()
     
-    # Collect all teacher-subject relationships
-    teacher_subjects = []
-    for teacher in teachers:
-        for subject in teacher.subjects:
-            teacher_subjects.append({
-                "teacher_id": teacher.id,
-                "subject_id": subject.id
-            })
-    
-    return teacher_subjects
+    return [{"teacher_id": teacher_id, "subject_id": subject_id} for teacher_id, subject_id in rows]
 
 @router.get("/teachers/{teacher_id}/subjects", response_model=List[SubjectDisplay])
 def read_teacher_subjects(
@@ -784,17 +705,11 @@ def assign_subject(
     teacher_id: int,
     subject_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Assign a subject to a teacher (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
     assign_subject_to_teacher(db, teacher_id, subject_id)
     return {"message": "Subject assigned to teacher successfully"}
 
@@ -803,17 +718,11 @@ def remove_subject(
     teacher_id: int,
     subject_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Remove a subject from a teacher (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
     remove_subject_from_teacher(db, teacher_id, subject_id)
     return {"message": "Subject removed from teacher successfully"}
 
@@ -823,12 +732,13 @@ def read_student_subjects(
     student_id: Optional[int] = None,
     subject_id: Optional[int] = None,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=500),
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_verified_user)
 ):
     """
-    Get a list of student-subject relationships
+    Get a list of student-subject relationships, paged by offset or by after_id
     """
     # If no student_id is provided and the current user is a student, use their ID
     if not student_id and current_user.role == UserRole.STUDENT:
@@ -842,122 +752,114 @@ def read_student_subjects(
     if subject_id:
         query = query.filter(StudentSubject.subject_id == subject_id)
     
-    # Add debug logging
-    print(f"Fetching student subjects for student_id={student_id}, subject_id={subject_id}")
+    if after_id is not None:
+        query = query.filter(StudentSubject.id > after_id).order_by(StudentSubject.id)
+    
+    logger.debug("Fetching student subjects for student_id=%s, subject_id=%s", student_id, subject_id)
     results = query.offset(skip).limit(limit).all()
-    print(f"Found {len(results)} student subjects")
+    logger.debug("Found %s student subjects", len(results))
     
     return results
 
-@router.post("/student-subjects", status_code=status.HTTP_201_CREATED)
+@router.post("/student-subjects", response_model=StudentSubjectCreateResponse, status_code=status.HTTP_201_CREATED)
 def create_student_subject(
     student_subject: StudentSubjectCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Create a new student-subject relationship (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
-    # Check if student exists and is a student
-    student = db.query(User).filter(
-        User.id == student_subject.student_id,
+    student_id = student_subject.student_id
+    subject_id = student_subject.subject_id
+    
+    # Look up the student, their group and faculty, the subject, an existing assignment
+    # and the subject-group relationship in one query
+    row = db.query(
+        User.group_id,
+        Group.name.label("group_name"),
+        Faculty.name.label("faculty_name"),
+        Group.faculty_id,
+        Subject.name.label("subject_name"),
+        StudentSubject.id.label("student_subject_id"),
+        SubjectGroup.id.label("subject_group_id")
+    ).select_from(User).outerjoin(
+        Group, Group.id == User.group_id
+    ).outerjoin(
+        Faculty, Faculty.id == Group.faculty_id
+    ).outerjoin(
+        Subject, Subject.id == subject_id
+    ).outerjoin(
+        StudentSubject, and_(StudentSubject.student_id == User.id, StudentSubject.subject_id == subject_id)
+    ).outerjoin(
+        SubjectGroup, and_(SubjectGroup.subject_id == subject_id, SubjectGroup.group_id == User.group_id)
+    ).filter(
+        User.id == student_id,
         User.role == UserRole.STUDENT
     ).first()
     
-    if not student:
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Student with ID {student_subject.student_id} not found"
+            detail=f"Student with ID {student_id} not found"
         )
     
-    # Check if subject exists
-    subject = db.query(Subject).filter(Subject.id == student_subject.subject_id).first()
-    
-    if not subject:
+    if row.subject_name is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Subject with ID {student_subject.subject_id} not found"
+            detail=f"Subject with ID {subject_id} not found"
         )
     
-    # Check if the relationship already exists
-    existing = db.query(StudentSubject).filter(
-        and_(
-            StudentSubject.student_id == student_subject.student_id,
-            StudentSubject.subject_id == student_subject.subject_id
-        )
-    ).first()
-    
-    if existing:
+    if row.student_subject_id is not None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Student is already assigned to this subject"
         )
     
-    # Get the student's group
-    if not student.group_id:
+    # The student must be in a group that belongs to a faculty
+    if not row.group_id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Student must be assigned to a group before being assigned to a subject"
         )
     
-    # Get the group info
-    group = db.query(Group).filter(Group.id == student.group_id).first()
-    if not group:
+    if row.group_name is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Group with ID {student.group_id} not found"
+            detail=f"Group with ID {row.group_id} not found"
         )
     
-    # Get the faculty info
-    faculty = db.query(Faculty).filter(Faculty.id == group.faculty_id).first()
-    if not faculty:
+    if row.faculty_name is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Faculty with ID {group.faculty_id} not found"
-        )
-    
-    # Check if a subject-group relationship exists
-    subject_group = db.query(SubjectGroup).filter(
-        and_(
-            SubjectGroup.subject_id == student_subject.subject_id,
-            SubjectGroup.group_id == student.group_id
+            detail=f"Faculty with ID {row.faculty_id} not found"
         )
-    ).first()
     
-    # Create a subject-group relationship if it doesn't exist
-    if not subject_group:
-        subject_group = SubjectGroup(
-            subject_id=student_subject.subject_id,
-            group_id=student.group_id
-        )
-        db.add(subject_group)
-        db.commit()
-        db.refresh(subject_group)
+    # Create the subject-group relationship if it doesn't exist, in the same transaction
+    if row.subject_group_id is None:
+        db.add(SubjectGroup(subject_id=subject_id, group_id=row.group_id))
     
     # Create the student-subject relationship
-    db_student_subject = StudentSubject(
-        student_id=student_subject.student_id,
-        subject_id=student_subject.subject_id
-    )
-    
+    db_student_subject = StudentSubject(student_id=student_id, subject_id=subject_id)
     db.add(db_student_subject)
-    db.commit()
-    db.refresh(db_student_subject)
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent request enrolled the student first; the unique index rejected the duplicate
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Student is already assigned to this subject"
+        )
     
     # Return the created student-subject and info for the journal
     return {
-        "student_subject": StudentSubjectDisplay.model_validate(db_student_subject),
+        "student_subject": db_student_subject,
         "journal_info": {
-            "faculty": faculty.name,
-            "group": group.name,
-            "subject": subject.name,
-            "journal_url": f"/journal/{urllib.parse.quote(faculty.name)}/{urllib.parse.quote(group.name)}/{urllib.parse.quote(subject.name)}"
+            "faculty": row.faculty_name,
+            "group": row.group_name,
+            "subject": row.subject_name,
+            "journal_url": journal_url(row.faculty_name, row.group_name, row.subject_name)
         }
     }
 
@@ -965,28 +867,18 @@ def create_student_subject(
 def delete_student_subject(
     student_subject_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Delete a student-subject relationship (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
-    # Get the relationship
-    student_subject = db.query(StudentSubject).filter(StudentSubject.id == student_subject_id).first()
-    
-    if not student_subject:
+    # Delete the relationship in one statement; no matching row means it doesn't exist
+    result = db.execute(delete(StudentSubject).where(StudentSubject.id == student_subject_id))
+    if result.rowcount == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Student-subject relationship with ID {student_subject_id} not found"
         )
-    
-    # Delete the relationship
-    db.delete(student_subject)
     db.commit()
     
     return None 
\ No newline at end of file
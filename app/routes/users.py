@@ -1,82 +1,89 @@
-from fastapi import APIRouter, Depends, status, HTTPException
+from fastapi import APIRouter, Depends, status, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import logging
 
 from app.database.connection import get_db
 from app.models import User, UserRole
-from app.schemas import UserDisplay, UserUpdate
+from app.schemas import UserCreate, UserDisplay, UserUpdate
 from app.services import (
     get_users, get_user_by_id, update_user, verify_user, 
     deactivate_user, get_users_by_role, get_unverified_users,
-    delete_user
+    delete_user, register_users_bulk, cached_user_list
 )
-from app.auth.jwt import get_current_verified_user
+from app.auth.jwt import get_current_verified_user, get_current_admin
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["Users"], prefix="/users")
 
 # Route for getting the current user
 @router.get("/me", response_model=UserDisplay)
-def read_users_me(current_user: User = Depends(get_current_verified_user)):
+async def read_users_me(current_user: User = Depends(get_current_verified_user)):
     """
     Get the current logged-in user
     """
     return current_user
 
 # Routes for admins
-@router.get("", response_model=List[UserDisplay])
+@router.get("", response_model=List[UserDisplay], response_model_exclude_none=True)
 def read_users(
     skip: int = 0, 
-    limit: int = 100, 
+    limit: int = Query(100, ge=1, le=500), 
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Get a list of all users (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
-    return get_users(db, skip=skip, limit=limit)
+    return get_users(db, skip=skip, limit=limit, after_id=after_id)
+
+@router.post("/bulk", status_code=status.HTTP_201_CREATED)
+def create_users_bulk(
+    users: List[UserCreate],
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_admin)
+):
+    """
+    Register many users at once, e.g. a student roster import (admin only)
+    """
+    return {"ids": register_users_bulk(db, users)}
 
-@router.get("/unverified", response_model=List[UserDisplay])
+@router.get("/unverified", response_model=List[UserDisplay], response_model_exclude_none=True)
 def read_unverified_users(
     skip: int = 0, 
-    limit: int = 100, 
+    limit: int = Query(100, ge=1, le=500), 
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Get a list of unverified users (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
-    return get_unverified_users(db, skip=skip, limit=limit)
+    # Only admins get here, so the cached list is the same for every caller
+    return cached_user_list(
+        ("unverified", skip, limit, after_id),
+        lambda: [UserDisplay.model_validate(user) for user in get_unverified_users(db, skip=skip, limit=limit, after_id=after_id)]
+    )
 
-@router.get("/role/{role}", response_model=List[UserDisplay])
+@router.get("/role/{role}", response_model=List[UserDisplay], response_model_exclude_none=True)
 def read_users_by_role(
     role: UserRole,
     skip: int = 0, 
-    limit: int = 100, 
+    limit: int = Query(100, ge=1, le=500), 
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Get a list of users by role (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
-    return get_users_by_role(db, role=role, skip=skip, limit=limit)
+    # Only admins get here, so the cached list is the same for every caller
+    return cached_user_list(
+        ("role", role, skip, limit, after_id),
+        lambda: [UserDisplay.model_validate(user) for user in get_users_by_role(db, role=role, skip=skip, limit=limit, after_id=after_id)]
+    )
 
 @router.get("/{user_id}", response_model=UserDisplay)
 def read_user(
@@ -115,39 +122,30 @@ def update_user_data(
     """
     Update a user
     """
-    # Add logging for debugging
-    print(f"Updating user {user_id}, data: {user_data}")
+    logger.debug("Updating user %s, data: %s", user_id, user_data)
     
     # Admins can update any user
     if current_user.role == UserRole.ADMIN:
         try:
             user = update_user(db, user_id, user_data)
-            print(f"User {user_id} updated successfully with group_id: {user.group_id}")
+            logger.debug("User %s updated successfully with group_id: %s", user_id, user.group_id)
             return user
         except Exception as e:
-            print(f"Error updating user {user_id}: {str(e)}")
+            logger.debug("Error updating user %s: %s", user_id, e)
             raise
     
     # Users can update their own data, but not role, is_active, or is_verified
     if current_user.id == user_id:
-        # Remove sensitive fields
-        user_data_dict = user_data.dict(exclude_unset=True)
-        
-        if "role" in user_data_dict:
-            del user_data_dict["role"]
-        
-        if "is_active" in user_data_dict:
-            del user_data_dict["is_active"]
-        
-        if "is_verified" in user_data_dict:
-            del user_data_dict["is_verified"]
+        # Clear the sensitive fields; update_user leaves None fields unchanged. UserUpdate has no
+        # role field, and model_copy skips re-running the field validators
+        sanitized = user_data.model_copy(update={"is_active": None, "is_verified": None})
         
         try:
-            user = update_user(db, user_id, UserUpdate(**user_data_dict))
-            print(f"User {user_id} updated their own data successfully")
+            user = update_user(db, user_id, sanitized)
+            logger.debug("User %s updated their own data successfully", user_id)
             return user
         except Exception as e:
-            print(f"Error updating user {user_id}: {str(e)}")
+            logger.debug("Error updating user %s: %s", user_id, e)
             raise
     
     raise HTTPException(
@@ -159,51 +157,33 @@ def update_user_data(
 def verify_user_account(
     user_id: int, 
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Verify a user (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
     return verify_user(db, user_id)
 
 @router.put("/{user_id}/deactivate", response_model=UserDisplay)
 def deactivate_user_account(
     user_id: int, 
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Deactivate a user (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
     return deactivate_user(db, user_id)
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_user_account(
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_verified_user)
+    current_user: User = Depends(get_current_admin)
 ):
     """
     Permanently delete a user (admin only)
     """
-    if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    
     # Prevent self-deletion
     if current_user.id == user_id:
         raise HTTPException(
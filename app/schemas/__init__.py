@@ -34,5 +34,7 @@ from app.schemas.journal import (
     AttendanceDisplay,
     JournalView,
     StudentSubjectCreate,
-    StudentSubjectDisplay
+    StudentSubjectDisplay,
+    JournalInfo,
+    StudentSubjectCreateResponse
 )
@@ -115,8 +115,8 @@ class JournalView(BaseModel):
     subject_group_id: int
     students: List[Dict[str, Any]]
     dates: List[str]  # ISO-formatted date strings
-    grades: Dict[str, Dict[str, Optional[int]]]
-    attendance: Dict[str, Dict[str, Optional[bool]]]
+    grades: Dict[str, Dict[str, Optional[int]]]  # student ID -> date -> grade; dates without one are omitted
+    attendance: Dict[str, Dict[str, Optional[bool]]]  # same shape, sparse like grades
     
     model_config = {
         "from_attributes": True,
@@ -136,4 +136,14 @@ class StudentSubjectCreate(StudentSubjectBase):
 class StudentSubjectDisplay(StudentSubjectBase):
     id: int
     
-    model_config = {"from_attributes": True} 
\ No newline at end of file
+    model_config = {"from_attributes": True} 
+
+class JournalInfo(BaseModel):
+    faculty: str
+    group: str
+    subject: str
+    journal_url: str
+
+class StudentSubjectCreateResponse(BaseModel):
+    student_subject: StudentSubjectDisplay
+    journal_info: JournalInfo
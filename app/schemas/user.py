@@ -30,8 +30,7 @@ class UserDisplay(UserBase):
     is_verified: bool
     group_id: Optional[int] = None
     
-    class Config:
-        from_attributes = True
+    model_config = {"from_attributes": True}
 
 class UserWithFaculties(UserDisplay):
     faculties: List["FacultyBase"] = []
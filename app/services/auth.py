@@ -1,26 +1,33 @@
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 from fastapi import HTTPException, status
 
 from app.models import User, UserRole
+from app.models.users import teacher_subject
 from app.schemas import UserCreate, UserLogin
-from app.auth.password import hash_password, verify_password
+from app.auth.password import hash_password, verify_password, password_needs_rehash, DUMMY_PASSWORD_HASH
 from app.auth.jwt import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.services.user import clear_user_list_cache
 
 def register_user(db: Session, user: UserCreate) -> User:
     """
     Register a new user with the given details
     """
-    # Check if the user with the given username or email already exists
-    existing_username = db.query(User).filter(User.username == user.username).first()
-    if existing_username:
+    # Check if the user with the given username or email already exists in one query
+    existing = db.query(User.username, User.email).filter(
+        or_(User.username == user.username, User.email == user.email)
+    ).all()
+    if any(row.username == user.username for row in existing):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
     
-    existing_email = db.query(User).filter(User.email == user.email).first()
-    if existing_email:
+    if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
@@ -38,20 +45,97 @@ def register_user(db: Session, user: UserCreate) -> User:
         group_id=user.group_id if user.role == UserRole.STUDENT else None
     )
     
+    # No cache is cleared here: this endpoint is public, so clearing would let anyone flush the
+    # caches at will. The user shows up in journals once verified, which clears them; the
+    # admin's unverified list catches up within USER_LIST_CACHE_TTL
     db.add(db_user)
     db.commit()
-    db.refresh(db_user)
     
     return db_user
 
-def authenticate_user(db: Session, user: UserLogin) -> User:
+def register_users_bulk(db: Session, users: List[UserCreate]) -> List[int]:
+    """
+    Register many users with one duplicate check and a single multi-row INSERT, returning their IDs
+    """
+    if not users:
+        return []
+    
+    usernames = [user.username for user in users]
+    emails = [user.email for user in users]
+    if len(set(usernames)) != len(usernames) or len(set(emails)) != len(emails):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Duplicate usernames or emails in request"
+        )
+    
+    # Check all usernames and emails against the database at once
+    existing = db.execute(
+        select(User.username, User.email).where(or_(User.username.in_(usernames), User.email.in_(emails)))
+    ).all()
+    existing_usernames = sorted({row.username for row in existing} & set(usernames))
+    if existing_usernames:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Usernames already registered: {', '.join(existing_usernames)}"
+        )
+    if existing:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Emails already registered: {', '.join(sorted(row.email for row in existing))}"
+        )
+    
+    # argon2 releases the GIL, so hash the passwords in parallel
+    with ThreadPoolExecutor(max_workers=min(8, len(users))) as executor:
+        hashed_passwords = list(executor.map(hash_password, [user.password for user in users]))
+    
+    rows = [
+        {
+            "username": user.username,
+            "email": user.email,
+            "full_name": user.full_name,
+            "hashed_password": hashed_password,
+            "role": user.role,
+            "is_active": True,
+            "is_verified": False,  # New users need to be verified by an admin
+            "group_id": user.group_id if user.role == UserRole.STUDENT else None
+        }
+        for user, hashed_password in zip(users, hashed_passwords)
+    ]
+    
+    # Return the IDs in payload order; RETURNING rows of a batched insert may otherwise come back in any order
+    user_ids = db.scalars(insert(User).returning(User.id, sort_by_parameter_order=True), rows).all()
+    db.commit()
+    # New users are unverified, so journals don't change until verify_user clears them
+    clear_user_list_cache()
+    
+    return list(user_ids)
+
+# Columns needed to log a user in and describe them in the response
+_LOGIN_COLUMNS = (
+    User.id,
+    User.username,
+    User.hashed_password,
+    User.role,
+    User.is_active,
+    User.is_verified,
+    User.full_name,
+    User.email,
+    User.group_id,
+)
+
+def authenticate_user(db: Session, user: UserLogin) -> Row:
     """
     Authenticate a user with the given username and password
     """
-    # Get the user from the database
-    db_user = db.query(User).filter(User.username == user.username).first()
+    # Fetch only the login columns as a plain row; no ORM object is built
+    db_user = db.execute(
+        select(*_LOGIN_COLUMNS).where(User.username == user.username)
+    ).one_or_none()
     
-    # Check if the user exists and the password is correct
+    # Check if the user exists and the password is correct; unknown users still pay for a
+    # verify so response times don't reveal which usernames exist
+    if not db_user:
+        verify_password(user.password, DUMMY_PASSWORD_HASH)
     if not db_user or not verify_password(user.password, db_user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -66,6 +150,13 @@ def authenticate_user(db: Session, user: UserLogin) -> User:
             detail="Inactive user"
         )
     
+    # Upgrade legacy bcrypt hashes now that the plain password is known
+    if password_needs_rehash(db_user.hashed_password):
+        db.execute(
+            update(User).where(User.id == db_user.id).values(hashed_password=hash_password(user.password))
+        )
+        db.commit()
+    
     return db_user
 
 def login_user(db: Session, user: UserLogin):
@@ -75,10 +166,18 @@ def login_user(db: Session, user: UserLogin):
     # Authenticate the user
     db_user = authenticate_user(db, user)
     
+    token_data = {"sub": db_user.username}
+    
+    # Embed a teacher's subject IDs so permission checks don't have to query teacher_subject
+    if db_user.role == UserRole.TEACHER:
+        token_data["subjects"] = list(db.scalars(
+            select(teacher_subject.c.subject_id).where(teacher_subject.c.user_id == db_user.id)
+        ))
+    
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": db_user.username},
+        data=token_data,
         expires_delta=access_token_expires
     )
     
@@ -1,8 +1,17 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import Integer, and_, cast, insert, literal, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, raiseload
 from fastapi import HTTPException, status
-from typing import List, Dict, Optional, Any
+from pydantic import ValidationError
+from typing import List, Dict, Optional, Any, Tuple
 from datetime import date
+import hashlib
+import logging
+import os
 
+from app.cache import LoadingCache
 from app.models import (
     Faculty, Group, Subject, SubjectGroup, 
     Grade, Attendance, User, UserRole
@@ -15,39 +24,73 @@ from app.schemas import (
     AttendanceCreate, AttendanceUpdate, JournalView
 )
 
-# Faculty services
-def create_faculty(db: Session, faculty: FacultyCreate) -> Faculty:
+logger = logging.getLogger(__name__)
+
+def _commit_unique(db: Session, detail: str) -> None:
     """
-    Create a new faculty
+    Commit the session, turning a unique index violation into a 400 with the given detail
     """
-    # Check if faculty with the same name already exists
-    existing_faculty = db.query(Faculty).filter(Faculty.name == faculty.name).first()
-    if existing_faculty:
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Faculty with name '{faculty.name}' already exists"
+            detail=detail
         )
-    
-    # Create the faculty
+
+def _commit_record(db: Session, subject_group_id: int, detail: str) -> None:
+    """
+    Commit a new grade or attendance record, relying on the subject-group foreign key instead of
+    a lookup beforehand; on failure tell a missing subject-group (404) from a duplicate (400)
+    """
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        get_subject_group_subject_id(db, subject_group_id)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=detail
+        )
+
+def _insert_ignoring_duplicates(db: Session, table):
+    """
+    Build an INSERT for table that skips rows conflicting with a unique index
+    """
+    dialect_insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    return dialect_insert(table).on_conflict_do_nothing()
+
+# Faculty services
+def create_faculty(db: Session, faculty: FacultyCreate) -> Faculty:
+    """
+    Create a new faculty
+    """
+    # Create the faculty; the unique name index rejects duplicates
     db_faculty = Faculty(name=faculty.name)
     
     db.add(db_faculty)
-    db.commit()
-    db.refresh(db_faculty)
+    _commit_unique(db, f"Faculty with name '{faculty.name}' already exists")
     
     return db_faculty
 
-def get_faculties(db: Session, skip: int = 0, limit: int = 100) -> List[Faculty]:
+def get_faculties(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[Row]:
     """
-    Get a list of faculties
+    Get a list of faculties as rows of the columns FacultyDisplay shows, paged by offset or by after_id
     """
-    return db.query(Faculty).offset(skip).limit(limit).all()
+    query = db.query(Faculty.id, Faculty.name)
+    
+    # Keyset pagination: continue after the last ID of the previous page instead of scanning skipped rows
+    if after_id is not None:
+        query = query.filter(Faculty.id > after_id).order_by(Faculty.id)
+    
+    return query.offset(skip).limit(limit).all()
 
 def get_faculty_by_id(db: Session, faculty_id: int) -> Faculty:
     """
     Get a faculty by its ID
     """
-    faculty = db.query(Faculty).filter(Faculty.id == faculty_id).first()
+    faculty = db.get(Faculty, faculty_id)
     if not faculty:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -63,43 +106,40 @@ def create_group(db: Session, group: GroupCreate) -> Group:
     # Check if the faculty exists
     faculty = get_faculty_by_id(db, group.faculty_id)
     
-    # Check if group with the same name already exists in the faculty
-    existing_group = db.query(Group).filter(
-        Group.name == group.name, 
-        Group.faculty_id == group.faculty_id
-    ).first()
-    
-    if existing_group:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Group with name '{group.name}' already exists in faculty '{faculty.name}'"
-        )
-    
-    # Create the group
+    # Create the group; the unique (faculty, name) index rejects duplicates
     db_group = Group(name=group.name, faculty_id=group.faculty_id)
     
     db.add(db_group)
-    db.commit()
-    db.refresh(db_group)
+    _commit_unique(db, f"Group with name '{group.name}' already exists in faculty '{faculty.name}'")
     
     return db_group
 
-def get_groups(db: Session, faculty_id: Optional[int] = None, skip: int = 0, limit: int = 100) -> List[Group]:
+def get_groups(
+    db: Session,
+    faculty_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None
+) -> List[Row]:
     """
-    Get a list of groups, optionally filtered by faculty
+    Get a list of groups as rows of the columns GroupDisplay shows, optionally filtered by faculty
     """
-    query = db.query(Group)
+    query = db.query(Group.id, Group.name, Group.faculty_id)
     
     if faculty_id:
         query = query.filter(Group.faculty_id == faculty_id)
     
+    # Keyset pagination: continue after the last ID of the previous page instead of scanning skipped rows
+    if after_id is not None:
+        query = query.filter(Group.id > after_id).order_by(Group.id)
+    
     return query.offset(skip).limit(limit).all()
 
 def get_group_by_id(db: Session, group_id: int) -> Group:
     """
     Get a group by its ID
     """
-    group = db.query(Group).filter(Group.id == group_id).first()
+    group = db.get(Group, group_id)
     if not group:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -115,19 +155,7 @@ def create_subject(db: Session, subject: SubjectCreate) -> Subject:
     # Check if the faculty exists
     faculty = get_faculty_by_id(db, subject.faculty_id)
     
-    # Check if subject with the same name already exists in the faculty
-    existing_subject = db.query(Subject).filter(
-        Subject.name == subject.name, 
-        Subject.faculty_id == subject.faculty_id
-    ).first()
-    
-    if existing_subject:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Subject with name '{subject.name}' already exists in faculty '{faculty.name}'"
-        )
-    
-    # Create the subject
+    # Create the subject; the unique (faculty, name) index rejects duplicates
     db_subject = Subject(
         name=subject.name, 
         description=subject.description, 
@@ -135,27 +163,43 @@ def create_subject(db: Session, subject: SubjectCreate) -> Subject:
     )
     
     db.add(db_subject)
-    db.commit()
-    db.refresh(db_subject)
+    _commit_unique(db, f"Subject with name '{subject.name}' already exists in faculty '{faculty.name}'")
     
     return db_subject
 
-def get_subjects(db: Session, faculty_id: Optional[int] = None, skip: int = 0, limit: int = 100) -> List[Subject]:
-    """
-    Get a list of subjects, optionally filtered by faculty
-    """
-    query = db.query(Subject)
+def get_subjects(
+    db: Session,
+    faculty_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100,
+    teacher_id: Optional[int] = None,
+    after_id: Optional[int] = None
+) -> List[Row]:
+    """
+    Get a list of subjects as rows of the columns SubjectDisplay shows, optionally filtered
+    by faculty and by the teacher assigned to them
+    """
+    query = db.query(Subject.id, Subject.name, Subject.description, Subject.faculty_id)
+    
+    if teacher_id:
+        query = query.join(teacher_subject, teacher_subject.c.subject_id == Subject.id).filter(
+            teacher_subject.c.user_id == teacher_id
+        )
     
     if faculty_id:
         query = query.filter(Subject.faculty_id == faculty_id)
     
+    # Keyset pagination: continue after the last ID of the previous page instead of scanning skipped rows
+    if after_id is not None:
+        query = query.filter(Subject.id > after_id).order_by(Subject.id)
+    
     return query.offset(skip).limit(limit).all()
 
 def get_subject_by_id(db: Session, subject_id: int) -> Subject:
     """
     Get a subject by its ID
     """
-    subject = db.query(Subject).filter(Subject.id == subject_id).first()
+    subject = db.get(Subject, subject_id)
     if not subject:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -174,27 +218,14 @@ def create_subject_group(db: Session, subject_group: SubjectGroupCreate) -> Subj
     # Check if the group exists
     group = get_group_by_id(db, subject_group.group_id)
     
-    # Check if the relationship already exists
-    existing_subject_group = db.query(SubjectGroup).filter(
-        SubjectGroup.subject_id == subject_group.subject_id,
-        SubjectGroup.group_id == subject_group.group_id
-    ).first()
-    
-    if existing_subject_group:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Relationship between subject '{subject.name}' and group '{group.name}' already exists"
-        )
-    
-    # Create the subject-group relationship
+    # Create the subject-group relationship; the unique (subject, group) index rejects duplicates
     db_subject_group = SubjectGroup(
         subject_id=subject_group.subject_id,
         group_id=subject_group.group_id
     )
     
     db.add(db_subject_group)
-    db.commit()
-    db.refresh(db_subject_group)
+    _commit_unique(db, f"Relationship between subject '{subject.name}' and group '{group.name}' already exists")
     
     return db_subject_group
 
@@ -203,12 +234,13 @@ def get_subject_groups(
     subject_id: Optional[int] = None, 
     group_id: Optional[int] = None, 
     skip: int = 0, 
-    limit: int = 100
+    limit: int = 100,
+    after_id: Optional[int] = None
 ) -> List[SubjectGroup]:
     """
     Get a list of subject-group relationships, optionally filtered by subject or group
     """
-    query = db.query(SubjectGroup)
+    query = db.query(SubjectGroup).options(raiseload("*"))
     
     if subject_id:
         query = query.filter(SubjectGroup.subject_id == subject_id)
@@ -216,13 +248,17 @@ def get_subject_groups(
     if group_id:
         query = query.filter(SubjectGroup.group_id == group_id)
     
+    # Keyset pagination: continue after the last ID of the previous page instead of scanning skipped rows
+    if after_id is not None:
+        query = query.filter(SubjectGroup.id > after_id).order_by(SubjectGroup.id)
+    
     return query.offset(skip).limit(limit).all()
 
 def get_subject_group_by_id(db: Session, subject_group_id: int) -> SubjectGroup:
     """
     Get a subject-group relationship by its ID
     """
-    subject_group = db.query(SubjectGroup).filter(SubjectGroup.id == subject_group_id).first()
+    subject_group = db.get(SubjectGroup, subject_group_id)
     if not subject_group:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -230,22 +266,31 @@ def get_subject_group_by_id(db: Session, subject_group_id: int) -> SubjectGroup:
         )
     return subject_group
 
+def get_subject_group_subject_id(db: Session, subject_group_id: int) -> int:
+    """
+    Get only the subject ID of a subject-group relationship, without loading the object
+    """
+    subject_id = db.query(SubjectGroup.subject_id).filter(SubjectGroup.id == subject_group_id).scalar()
+    if subject_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Subject-group relationship with ID {subject_group_id} not found"
+        )
+    return subject_id
+
 # Grade services
 def create_grade(db: Session, grade: GradeCreate) -> Grade:
     """
     Create a new grade
     """
     # Check if the student exists
-    student = db.query(User).filter(User.id == grade.student_id).first()
-    if not student or student.role != UserRole.STUDENT:
+    student_role = db.query(User.role).filter(User.id == grade.student_id).scalar()
+    if student_role != UserRole.STUDENT:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Student with ID {grade.student_id} not found"
         )
     
-    # Check if the subject-group relationship exists
-    subject_group = get_subject_group_by_id(db, grade.subject_group_id)
-    
     # Create the grade
     db_grade = Grade(
         student_id=grade.student_id,
@@ -255,9 +300,10 @@ def create_grade(db: Session, grade: GradeCreate) -> Grade:
         description=grade.description
     )
     
+    # The subject-group foreign key is checked by the database on commit
     db.add(db_grade)
-    db.commit()
-    db.refresh(db_grade)
+    _commit_record(db, grade.subject_group_id, f"Grade for student ID {grade.student_id} could not be created")
+    clear_journal_cache()
     
     return db_grade
 
@@ -265,13 +311,17 @@ def get_grades(
     db: Session, 
     student_id: Optional[int] = None, 
     subject_group_id: Optional[int] = None, 
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
     skip: int = 0, 
-    limit: int = 100
+    limit: int = 100,
+    after_id: Optional[int] = None
 ) -> List[Grade]:
     """
-    Get a list of grades, optionally filtered by student or subject-group
+    Get a list of grades, optionally filtered by student, subject-group or date range,
+    paged by offset or by after_id
     """
-    query = db.query(Grade)
+    query = db.query(Grade).options(raiseload("*"))
     
     if student_id:
         query = query.filter(Grade.student_id == student_id)
@@ -279,6 +329,17 @@ def get_grades(
     if subject_group_id:
         query = query.filter(Grade.subject_group_id == subject_group_id)
     
+    # Period bounds are inclusive and use the date column of the composite indexes
+    if date_from:
+        query = query.filter(Grade.date >= date_from)
+    
+    if date_to:
+        query = query.filter(Grade.date <= date_to)
+    
+    # Keyset pagination: continue after the last ID of the previous page instead of scanning skipped rows
+    if after_id is not None:
+        query = query.filter(Grade.id > after_id).order_by(Grade.id)
+    
     return query.offset(skip).limit(limit).all()
 
 def update_grade(db: Session, grade_id: int, grade_data: GradeUpdate) -> Grade:
@@ -286,7 +347,8 @@ def update_grade(db: Session, grade_id: int, grade_data: GradeUpdate) -> Grade:
     Update a grade
     """
     # Get the grade
-    grade = db.query(Grade).filter(Grade.id == grade_id).first()
+    # db.get() reuses the instance if the caller already loaded it in this session
+    grade = db.get(Grade, grade_id)
     if not grade:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -306,7 +368,7 @@ def update_grade(db: Session, grade_id: int, grade_data: GradeUpdate) -> Grade:
         grade.description = grade_data.description
     
     db.commit()
-    db.refresh(grade)
+    clear_journal_cache()
     
     return grade
 
@@ -316,30 +378,15 @@ def create_attendance(db: Session, attendance: AttendanceCreate) -> Attendance:
     Create a new attendance record
     """
     # Check if the student exists
-    student = db.query(User).filter(User.id == attendance.student_id).first()
-    if not student or student.role != UserRole.STUDENT:
+    student_role = db.query(User.role).filter(User.id == attendance.student_id).scalar()
+    if student_role != UserRole.STUDENT:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Student with ID {attendance.student_id} not found"
         )
     
-    # Check if the subject-group relationship exists
-    subject_group = get_subject_group_by_id(db, attendance.subject_group_id)
-    
-    # Check if an attendance record for this student on this date already exists
-    existing_attendance = db.query(Attendance).filter(
-        Attendance.student_id == attendance.student_id,
-        Attendance.subject_group_id == attendance.subject_group_id,
-        Attendance.date == attendance.date
-    ).first()
-    
-    if existing_attendance:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Attendance record for student ID {attendance.student_id} on date {attendance.date} already exists"
-        )
-    
-    # Create the attendance record
+    # Create the attendance record; the unique (student, subject-group, date) index rejects duplicates
+    # and the subject-group foreign key is checked by the database on commit
     db_attendance = Attendance(
         student_id=attendance.student_id,
         subject_group_id=attendance.subject_group_id,
@@ -348,8 +395,10 @@ def create_attendance(db: Session, attendance: AttendanceCreate) -> Attendance:
     )
     
     db.add(db_attendance)
-    db.commit()
-    db.refresh(db_attendance)
+    _commit_record(
+        db, attendance.subject_group_id, f"Attendance record for student ID {attendance.student_id} on date {attendance.date} already exists"
+    )
+    clear_journal_cache()
     
     return db_attendance
 
@@ -357,13 +406,17 @@ def get_attendance(
     db: Session, 
     student_id: Optional[int] = None, 
     subject_group_id: Optional[int] = None, 
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
     skip: int = 0, 
-    limit: int = 100
+    limit: int = 100,
+    after_id: Optional[int] = None
 ) -> List[Attendance]:
     """
-    Get a list of attendance records, optionally filtered by student or subject-group
+    Get a list of attendance records, optionally filtered by student, subject-group or date range,
+    paged by offset or by after_id
     """
-    query = db.query(Attendance)
+    query = db.query(Attendance).options(raiseload("*"))
     
     if student_id:
         query = query.filter(Attendance.student_id == student_id)
@@ -371,6 +424,17 @@ def get_attendance(
     if subject_group_id:
         query = query.filter(Attendance.subject_group_id == subject_group_id)
     
+    # Period bounds are inclusive and use the date column of the composite indexes
+    if date_from:
+        query = query.filter(Attendance.date >= date_from)
+    
+    if date_to:
+        query = query.filter(Attendance.date <= date_to)
+    
+    # Keyset pagination: continue after the last ID of the previous page instead of scanning skipped rows
+    if after_id is not None:
+        query = query.filter(Attendance.id > after_id).order_by(Attendance.id)
+    
     return query.offset(skip).limit(limit).all()
 
 def update_attendance(db: Session, attendance_id: int, attendance_data: AttendanceUpdate) -> Attendance:
@@ -378,7 +442,8 @@ def update_attendance(db: Session, attendance_id: int, attendance_data: Attendan
     Update an attendance record
     """
     # Get the attendance record
-    attendance = db.query(Attendance).filter(Attendance.id == attendance_id).first()
+    # db.get() reuses the instance if the caller already loaded it in this session
+    attendance = db.get(Attendance, attendance_id)
     if not attendance:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -394,204 +459,283 @@ def update_attendance(db: Session, attendance_id: int, attendance_data: Attendan
         attendance.date = attendance_data.date
     
     db.commit()
-    db.refresh(attendance)
+    clear_journal_cache()
     
     return attendance
 
+# Bulk write helpers
+def _check_bulk_targets(db: Session, student_ids: set, subject_group_ids: set) -> None:
+    """
+    Make sure every student and subject-group referenced by a bulk payload exists
+    """
+    found_students = {
+        row.id for row in db.query(User.id).filter(
+            User.id.in_(student_ids),
+            User.role == UserRole.STUDENT
+        )
+    }
+    missing_students = student_ids - found_students
+    if missing_students:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Students with IDs {sorted(missing_students)} not found"
+        )
+    
+    found_subject_groups = {
+        row.id for row in db.query(SubjectGroup.id).filter(SubjectGroup.id.in_(subject_group_ids))
+    }
+    missing_subject_groups = subject_group_ids - found_subject_groups
+    if missing_subject_groups:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Subject-groups with IDs {sorted(missing_subject_groups)} not found"
+        )
+
+def create_grades_bulk(db: Session, grades: List[GradeCreate]) -> int:
+    """
+    Create many grades with a single multi-row INSERT and return how many were created
+    """
+    if not grades:
+        return 0
+    
+    _check_bulk_targets(
+        db,
+        {grade.student_id for grade in grades},
+        {grade.subject_group_id for grade in grades}
+    )
+    
+    rows = [
+        {
+            "student_id": grade.student_id,
+            "subject_group_id": grade.subject_group_id,
+            "grade": grade.grade,
+            "date": grade.date,
+            "description": grade.description
+        }
+        for grade in grades
+    ]
+    
+    db.execute(insert(Grade), rows)
+    db.commit()
+    clear_journal_cache()
+    
+    return len(rows)
+
+def create_attendance_bulk(db: Session, records: List[AttendanceCreate]) -> int:
+    """
+    Create many attendance records with a single multi-row INSERT, skipping ones that already
+    exist, and return how many were created
+    """
+    if not records:
+        return 0
+    
+    _check_bulk_targets(
+        db,
+        {record.student_id for record in records},
+        {record.subject_group_id for record in records}
+    )
+    
+    rows = [
+        {
+            "student_id": record.student_id,
+            "subject_group_id": record.subject_group_id,
+            "date": record.date,
+            "is_present": record.is_present
+        }
+        for record in records
+    ]
+    
+    # One record per student, subject-group and date within the payload
+    keys = [(row["student_id"], row["subject_group_id"], row["date"]) for row in rows]
+    if len(set(keys)) != len(keys):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Duplicate attendance records in request"
+        )
+    
+    # Records that already exist are skipped by the unique day index, so resubmitting a
+    # class register only adds the missing marks; RETURNING counts the rows actually inserted
+    created = db.scalars(
+        _insert_ignoring_duplicates(db, Attendance.__table__).returning(Attendance.id), rows
+    ).all()
+    db.commit()
+    clear_journal_cache()
+    
+    return len(created)
+
 # Journal view service
 def get_journal_view(db: Session, subject_id: int, group_id: int) -> JournalView:
     """
     Get a structured view of the journal for a specific subject and group
     """
-    try:
-        print(f"Starting get_journal_view for subject_id={subject_id}, group_id={group_id}")
-        
-        # Get the subject
-        print(f"Getting subject with ID {subject_id}")
-        subject = get_subject_by_id(db, subject_id)
-        print(f"Found subject: {subject.name}")
-        
-        # Get the group
-        print(f"Getting group with ID {group_id}")
+    # Get the subject, group and faculty names and the subject-group relationship in one query
+    row = db.query(
+        Subject.name.label("subject_name"),
+        Group.name.label("group_name"),
+        Faculty.name.label("faculty_name"),
+        SubjectGroup.id.label("subject_group_id")
+    ).select_from(Subject).join(
+        Group, Group.id == group_id
+    ).join(
+        Faculty, Faculty.id == Group.faculty_id
+    ).outerjoin(
+        SubjectGroup, and_(SubjectGroup.subject_id == subject_id, SubjectGroup.group_id == group_id)
+    ).filter(
+        Subject.id == subject_id
+    ).first()
+    
+    if row is None:
+        # Let the single-entity lookups raise the matching 404
+        get_subject_by_id(db, subject_id)
         group = get_group_by_id(db, group_id)
-        print(f"Found group: {group.name}")
-        
-        # Get the faculty
-        print(f"Getting faculty with ID {group.faculty_id}")
-        faculty = get_faculty_by_id(db, group.faculty_id)
-        print(f"Found faculty: {faculty.name}")
-        
-        # Get the subject-group relationship
-        print(f"Looking for subject-group relationship")
-        subject_group = db.query(SubjectGroup).filter(
-            SubjectGroup.subject_id == subject_id,
-            SubjectGroup.group_id == group_id
-        ).first()
-        
-        if not subject_group:
-            print(f"No subject-group relationship found, creating one")
-            # Create the relationship if it doesn't exist
-            subject_group = SubjectGroup(
-                subject_id=subject_id,
-                group_id=group_id
-            )
-            db.add(subject_group)
-            db.commit()
-            db.refresh(subject_group)
-            print(f"Created new subject-group relationship with ID {subject_group.id}")
+        get_faculty_by_id(db, group.faculty_id)
+    
+    subject_group_id = row.subject_group_id
+    if subject_group_id is None:
+        # Create the relationship if it doesn't exist
+        subject_group = SubjectGroup(
+            subject_id=subject_id,
+            group_id=group_id
+        )
+        db.add(subject_group)
+        db.flush()
+        subject_group_id = subject_group.id
+        db.commit()
+        logger.debug("Created new subject-group relationship with ID %s", subject_group_id)
+    
+    # Get students in the group, only the columns the journal shows
+    students = db.query(User.id, User.full_name, User.username).filter(
+        User.group_id == group_id,
+        User.role == UserRole.STUDENT,
+        User.is_active == True,
+        User.is_verified == True
+    ).all()
+    
+    # Get the grades and attendance marks for this subject-group in one round-trip, ordered by date;
+    # kind tells them apart and attendance is cast so both share an integer value column
+    entries = db.execute(union_all(
+        select(literal("g").label("kind"), Grade.student_id, Grade.date, Grade.grade.label("value")).where(
+            Grade.subject_group_id == subject_group_id
+        ),
+        select(literal("a"), Attendance.student_id, Attendance.date, cast(Attendance.is_present, Integer)).where(
+            Attendance.subject_group_id == subject_group_id
+        )
+    ).order_by("date")).all()
+    
+    # Collect the unique dates; entries arrive sorted, so first-seen order is date order.
+    # Each date is formatted once
+    date_keys = {}
+    for entry in entries:
+        if entry.date not in date_keys:
+            date_keys[entry.date] = entry.date.isoformat()
+    
+    # If no dates, add today's date to avoid empty journal
+    if not date_keys:
+        today = date.today()
+        date_keys[today] = today.isoformat()
+    
+    # Format each student ID once
+    student_keys = {s.id: str(s.id) for s in students}
+    
+    # Prepare the student data - allow empty list if no students
+    student_data = []
+    for s in students:
+        student_data.append({
+            "id": s.id, 
+            "name": s.full_name if s.full_name else f"Student {s.id}", 
+            "username": s.username
+        })
+    
+    # Prepare the grades and attendance data as sparse maps: only dates with a record
+    # are present, a missing date means no grade or no attendance mark
+    grades_data = {key: {} for key in student_keys.values()}
+    attendance_data = {key: {} for key in student_keys.values()}
+    for entry in entries:
+        student_key = student_keys.get(entry.student_id)
+        if student_key is None:
+            continue
+        if entry.kind == "g":
+            grades_data[student_key][date_keys[entry.date]] = entry.value
         else:
-            print(f"Found subject-group relationship with ID {subject_group.id}")
-        
-        # Get students in the group
-        print(f"Getting students in group {group_id}")
-        students = db.query(User).filter(
-            User.group_id == group_id,
-            User.role == UserRole.STUDENT,
-            User.is_active == True,
-            User.is_verified == True
-        ).all()
-        
-        print(f"Found {len(students)} students in the group")
-        
-        # Get all grades for this subject-group
-        print(f"Getting grades for subject-group {subject_group.id}")
-        grades = db.query(Grade).filter(
-            Grade.subject_group_id == subject_group.id
-        ).all()
-        print(f"Found {len(grades)} grades")
-        
-        # Get all attendance records for this subject-group
-        print(f"Getting attendance records for subject-group {subject_group.id}")
-        attendance_records = db.query(Attendance).filter(
-            Attendance.subject_group_id == subject_group.id
-        ).all()
-        print(f"Found {len(attendance_records)} attendance records")
-        
-        # Extract unique dates from grades and attendance
-        print("Extracting unique dates")
-        grade_dates = [g.date for g in grades]
-        attendance_dates = [a.date for a in attendance_records]
-        all_dates = sorted(list(set(grade_dates + attendance_dates)))
-        print(f"Found {len(all_dates)} unique dates")
-        
-        # If no dates, add today's date to avoid empty journal
-        if not all_dates:
-            print("No dates found, adding today's date")
-            today = date.today()
-            all_dates = [today]
-        
-        # Prepare the student data - allow empty list if no students
-        print("Preparing student data")
-        student_data = []
-        for s in students:
-            student_data.append({
-                "id": s.id, 
-                "name": s.full_name if s.full_name else f"Student {s.id}", 
-                "username": s.username
-            })
-        print(f"Prepared data for {len(student_data)} students")
-        
-        # Prepare the grades data - allow empty dict if no students
-        print("Preparing grades data")
-        grades_data = {}
-        for student in students:
-            grades_data[str(student.id)] = {}
-            for d in all_dates:
-                grades_data[str(student.id)][d.isoformat()] = None
-        
-        for grade in grades:
-            student_id = str(grade.student_id)
-            date_str = grade.date.isoformat()
-            if student_id in grades_data and date_str in grades_data[student_id]:
-                grades_data[student_id][date_str] = grade.grade
-        print("Grades data prepared")
-        
-        # Prepare the attendance data - allow empty dict if no students
-        print("Preparing attendance data")
-        attendance_data = {}
-        for student in students:
-            attendance_data[str(student.id)] = {}
-            for d in all_dates:
-                attendance_data[str(student.id)][d.isoformat()] = None
-        
-        for attendance in attendance_records:
-            student_id = str(attendance.student_id)
-            date_str = attendance.date.isoformat()
-            if student_id in attendance_data and date_str in attendance_data[student_id]:
-                attendance_data[student_id][date_str] = attendance.is_present
-        print("Attendance data prepared")
-        
-        # Create the journal view
-        print("Creating JournalView object")
-        date_strings = [d.isoformat() for d in all_dates]
-        print(f"Date strings: {date_strings}")
-        
-        try:
-            journal = JournalView(
-                subject=subject.name,
-                group=group.name,
-                faculty=faculty.name,
-                subject_group_id=subject_group.id,
-                students=student_data,
-                dates=date_strings,
-                grades=grades_data,
-                attendance=attendance_data
-            )
-            print("JournalView object created successfully")
-            
-            return journal
-        except Exception as model_error:
-            print(f"Error creating JournalView object: {str(model_error)}")
-            raise Exception(f"Failed to create JournalView model: {str(model_error)}")
-            
-    except HTTPException as http_exc:
-        # Re-raise HTTP exceptions as they already have status codes and details
-        print(f"HTTP exception in get_journal_view: {http_exc.detail}")
-        raise http_exc
-    except Exception as e:
-        # For other exceptions, wrap them in an HTTPException with a detailed message
-        print(f"Error in get_journal_view: {str(e)}")
-        import traceback
-        traceback.print_exc()
+            attendance_data[student_key][date_keys[entry.date]] = None if entry.value is None else bool(entry.value)
+    
+    logger.debug(
+        "Journal view for subject-group %s: %s students, %s grades and attendance records, %s dates",
+        subject_group_id, len(students), len(entries), len(date_keys)
+    )
+    
+    # Create the journal view
+    date_strings = list(date_keys.values())
+    
+    # Only the model validation is guarded; database errors reach the app's 500 handler as they are
+    try:
+        return JournalView(
+            subject=row.subject_name,
+            group=row.group_name,
+            faculty=row.faculty_name,
+            subject_group_id=subject_group_id,
+            students=student_data,
+            dates=date_strings,
+            grades=grades_data,
+            attendance=attendance_data
+        )
+    except ValidationError as e:
+        logger.exception("Error creating JournalView object for subject-group %s", subject_group_id)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to get journal data: {str(e)}"
+            detail=f"Failed to get journal data: {e.error_count()} invalid fields"
         )
 
-def assign_subject_to_teacher(db: Session, teacher_id: int, subject_id: int) -> bool:
+# Journal views are reloaded over and over during a lesson; each worker keeps them briefly
+# with an ETag, and grade, attendance and student changes clear them right away
+_journal_cache = LoadingCache(maxsize=256, ttl=int(os.getenv("JOURNAL_CACHE_TTL", "30")))
+
+def _build_journal_view(db: Session, subject_id: int, group_id: int) -> Tuple[str, bytes]:
+    # Serialize once with pydantic's encoder; the same bytes are hashed and sent on every hit
+    body = get_journal_view(db, subject_id, group_id).model_dump_json().encode()
+    etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    return etag, body
+
+def get_cached_journal_view(db: Session, subject_id: int, group_id: int) -> Tuple[str, bytes]:
     """
-    Assign a subject to a teacher
+    Get the journal view for a subject and group as JSON bytes with its ETag, building it on a cache miss
     """
-    # Check if teacher exists
-    teacher = db.query(User).filter(
-        User.id == teacher_id,
-        User.role == UserRole.TEACHER
-    ).first()
-    
-    if not teacher:
+    return _journal_cache.get_or_load(
+        (subject_id, group_id), lambda: _build_journal_view(db, subject_id, group_id)
+    )
+
+def clear_journal_cache() -> None:
+    """
+    Drop the cached journal views after grades, attendance or students change
+    """
+    _journal_cache.clear()
+
+def _check_teacher_and_subject(db: Session, teacher_id: int, subject_id: int) -> None:
+    """
+    Make sure the teacher and the subject exist, selecting only their IDs
+    """
+    if db.query(User.id).filter(User.id == teacher_id, User.role == UserRole.TEACHER).scalar() is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Teacher with ID {teacher_id} not found"
         )
     
-    # Check if subject exists
-    subject = get_subject_by_id(db, subject_id)
-    
-    # Check if the assignment already exists
-    existing = db.query(teacher_subject).filter(
-        teacher_subject.c.user_id == teacher_id,
-        teacher_subject.c.subject_id == subject_id
-    ).first()
-    
-    if existing:
-        return True  # Already assigned
+    if db.query(Subject.id).filter(Subject.id == subject_id).scalar() is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Subject with ID {subject_id} not found"
+        )
+
+def assign_subject_to_teacher(db: Session, teacher_id: int, subject_id: int) -> bool:
+    """
+    Assign a subject to a teacher
+    """
+    _check_teacher_and_subject(db, teacher_id, subject_id)
     
-    # Create the assignment
+    # Insert the assignment in a single statement; the unique pair index makes an
+    # existing or concurrently inserted assignment a no-op
     db.execute(
-        teacher_subject.insert().values(
-            user_id=teacher_id,
-            subject_id=subject_id
-        )
+        _insert_ignoring_duplicates(db, teacher_subject).values(user_id=teacher_id, subject_id=subject_id)
     )
     db.commit()
     
@@ -601,23 +745,10 @@ def remove_subject_from_teacher(db: Session, teacher_id: int, subject_id: int) -
     """
     Remove a subject assignment from a teacher
     """
-    # Check if teacher exists
-    teacher = db.query(User).filter(
-        User.id == teacher_id,
-        User.role == UserRole.TEACHER
-    ).first()
-    
-    if not teacher:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Teacher with ID {teacher_id} not found"
-        )
-    
-    # Check if subject exists
-    subject = get_subject_by_id(db, subject_id)
+    _check_teacher_and_subject(db, teacher_id, subject_id)
     
     # Delete the assignment
-    result = db.execute(
+    db.execute(
         teacher_subject.delete().where(
             teacher_subject.c.user_id == teacher_id,
             teacher_subject.c.subject_id == subject_id
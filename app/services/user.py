@@ -1,22 +1,69 @@
+from sqlalchemy import delete, or_
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 from typing import List, Optional
+import logging
+import os
 
+from app.cache import LoadingCache
 from app.models import User, UserRole, Group
 from app.schemas import UserUpdate
 from app.auth.password import hash_password
+from app.auth.jwt import forget_cached_user
+from app.services.journal import clear_journal_cache
 
-def get_users(db: Session, skip: int = 0, limit: int = 100) -> List[User]:
+logger = logging.getLogger(__name__)
+
+# Admins reload the unverified and per-role lists while reviewing registrations, but they change
+# rarely; each worker keeps them briefly and every user write clears them right away
+_user_list_cache = LoadingCache(maxsize=128, ttl=int(os.getenv("USER_LIST_CACHE_TTL", "30")))
+
+def cached_user_list(key: tuple, load):
+    """
+    Return the cached admin user list for key, loading and caching it on a miss
+    """
+    return _user_list_cache.get_or_load(key, load)
+
+def clear_user_list_cache() -> None:
     """
-    Get a list of users
+    Drop the cached admin user lists after users are created, changed or deleted
     """
-    return db.query(User).offset(skip).limit(limit).all()
+    _user_list_cache.clear()
+
+# Columns the user lists show (UserDisplay); rows are returned instead of ORM objects
+_DISPLAY_COLUMNS = (
+    User.id,
+    User.username,
+    User.email,
+    User.full_name,
+    User.role,
+    User.is_active,
+    User.is_verified,
+    User.group_id,
+)
+
+def _page_users(query, skip: int, limit: int, after_id: Optional[int]) -> List[Row]:
+    """
+    Apply offset or keyset pagination to a user query
+    """
+    # Keyset pagination: continue after the last ID of the previous page instead of scanning skipped rows
+    if after_id is not None:
+        query = query.filter(User.id > after_id).order_by(User.id)
+    
+    return query.offset(skip).limit(limit).all()
+
+def get_users(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[Row]:
+    """
+    Get a list of users, paged by offset or by after_id
+    """
+    return _page_users(db.query(*_DISPLAY_COLUMNS), skip, limit, after_id)
 
 def get_user_by_id(db: Session, user_id: int) -> User:
     """
     Get a user by their ID
     """
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -42,12 +89,19 @@ def update_user(db: Session, user_id: int, user_data: UserUpdate) -> User:
     """
     # Get the user
     user = get_user_by_id(db, user_id)
-    print(f"Updating user: id={user.id}, username={user.username}, role={user.role}, current group_id={user.group_id}")
+    logger.debug("Updating user: id=%s, username=%s, role=%s, current group_id=%s", user.id, user.username, user.role, user.group_id)
+    
+    # Check the new username and email against other users in one query
+    taken = []
+    if user_data.username is not None and user_data.username != user.username:
+        taken.append(User.username == user_data.username)
+    if user_data.email is not None and user_data.email != user.email:
+        taken.append(User.email == user_data.email)
+    conflicts = db.query(User.username, User.email).filter(or_(*taken), User.id != user_id).all() if taken else []
     
     # Update username if provided
     if user_data.username is not None:
-        existing_username = db.query(User).filter(User.username == user_data.username).first()
-        if existing_username and existing_username.id != user_id:
+        if any(row.username == user_data.username for row in conflicts):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already taken"
@@ -56,8 +110,7 @@ def update_user(db: Session, user_id: int, user_data: UserUpdate) -> User:
     
     # Update email if provided
     if user_data.email is not None:
-        existing_email = db.query(User).filter(User.email == user_data.email).first()
-        if existing_email and existing_email.id != user_id:
+        if any(row.email == user_data.email for row in conflicts):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already taken"
@@ -82,7 +135,7 @@ def update_user(db: Session, user_id: int, user_data: UserUpdate) -> User:
     
     # Update group_id if provided (for students)
     if user_data.group_id is not None:
-        print(f"Attempting to update group_id to {user_data.group_id}")
+        logger.debug("Attempting to update group_id to %s", user_data.group_id)
         
         # Check if user is a student
         if user.role != UserRole.STUDENT:
@@ -93,20 +146,22 @@ def update_user(db: Session, user_id: int, user_data: UserUpdate) -> User:
         
         # Check if group exists if not null
         if user_data.group_id is not None:
-            group = db.query(Group).filter(Group.id == user_data.group_id).first()
+            group = db.get(Group, user_data.group_id)
             if not group:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Group with ID {user_data.group_id} not found"
                 )
-            print(f"Found group: {group.name} (id={group.id})")
+            logger.debug("Found group: %s (id=%s)", group.name, group.id)
         
         user.group_id = user_data.group_id
-        print(f"Updated group_id to {user.group_id}")
+        logger.debug("Updated group_id to %s", user.group_id)
     
     db.commit()
-    db.refresh(user)
-    print(f"User updated successfully: id={user.id}, group_id={user.group_id}")
+    forget_cached_user(user.id)
+    clear_user_list_cache()
+    clear_journal_cache()
+    logger.debug("User updated successfully: id=%s, group_id=%s", user.id, user.group_id)
     
     return user
 
@@ -118,7 +173,9 @@ def verify_user(db: Session, user_id: int) -> User:
     user.is_verified = True
     
     db.commit()
-    db.refresh(user)
+    forget_cached_user(user_id)
+    clear_user_list_cache()
+    clear_journal_cache()
     
     return user
 
@@ -130,39 +187,56 @@ def deactivate_user(db: Session, user_id: int) -> User:
     user.is_active = False
     
     db.commit()
-    db.refresh(user)
+    forget_cached_user(user_id)
+    clear_user_list_cache()
+    clear_journal_cache()
     
     return user
 
-def get_users_by_role(db: Session, role: UserRole, skip: int = 0, limit: int = 100) -> List[User]:
+def get_users_by_role(
+    db: Session, role: UserRole, skip: int = 0, limit: int = 100, after_id: Optional[int] = None
+) -> List[Row]:
     """
     Get users by their role
     """
-    return db.query(User).filter(User.role == role).offset(skip).limit(limit).all()
+    query = db.query(*_DISPLAY_COLUMNS).filter(User.role == role)
+    return _page_users(query, skip, limit, after_id)
 
-def get_unverified_users(db: Session, skip: int = 0, limit: int = 100) -> List[User]:
+def get_unverified_users(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[Row]:
     """
     Get users that are not yet verified
     """
-    return db.query(User).filter(User.is_verified == False).offset(skip).limit(limit).all()
+    query = db.query(*_DISPLAY_COLUMNS).filter(User.is_verified == False)
+    return _page_users(query, skip, limit, after_id)
 
 def delete_user(db: Session, user_id: int) -> None:
     """
     Completely delete a user from the database
     """
-    user = get_user_by_id(db, user_id)
+    # Only the role is needed, so don't load the whole user
+    role = db.query(User.role).filter(User.id == user_id).scalar()
+    if role is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"User with ID {user_id} not found"
+        )
     
     # Don't allow deleting the last admin
-    if user.role == UserRole.ADMIN:
-        admin_count = db.query(User).filter(User.role == UserRole.ADMIN).count()
-        if admin_count <= 1:
+    if role == UserRole.ADMIN:
+        other_admin = db.query(
+            db.query(User).filter(User.role == UserRole.ADMIN, User.id != user_id).exists()
+        ).scalar()
+        if not other_admin:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Cannot delete the last admin user"
             )
     
-    # Delete the user
-    db.delete(user)
+    # Delete the user in one statement; the database's ON DELETE rules handle related rows
+    db.execute(delete(User).where(User.id == user_id))
     db.commit()
+    forget_cached_user(user_id)
+    clear_user_list_cache()
+    clear_journal_cache()
     
     return None 
\ No newline at end of file
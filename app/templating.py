@@ -0,0 +1,44 @@
+from fastapi import Request
+from fastapi.templating import Jinja2Templates
+from datetime import datetime
+import functools
+import urllib.parse
+
+# Shared Jinja2 environment for every HTML route
+templates = Jinja2Templates(directory="app/templates")
+
+# Faculty, group and subject names repeat a lot, so cache their URL-encoded form
+@functools.lru_cache(maxsize=1024)
+def quote_path_segment(value: str) -> str:
+    return urllib.parse.quote(value)
+
+# Helper function to build the journal page URL for a faculty, group and subject
+def journal_url(faculty: str, group: str, subject: str) -> str:
+    return f"/journal/{quote_path_segment(faculty)}/{quote_path_segment(group)}/{quote_path_segment(subject)}"
+
+# Add custom filters to Jinja2
+def format_date(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        return value.strftime("%d.%m.%Y")
+    return value
+
+# Helper function to get flash messages
+def get_flash_messages(request: Request):
+    messages = request.session.get("flash_messages", [])
+    request.session["flash_messages"] = []
+    return messages
+
+# Helper function to add flash messages
+def flash(request: Request, message: str, category: str = "info"):
+    if "flash_messages" not in request.session:
+        request.session["flash_messages"] = []
+    request.session["flash_messages"].append({"message": message, "category": category})
+
+templates.env.filters["date"] = format_date
+templates.env.globals["format_date"] = format_date
+templates.env.globals["get_flash_messages"] = get_flash_messages
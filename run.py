@@ -6,11 +6,16 @@ if __name__ == "__main__":
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8000"))
     debug = os.getenv("DEBUG", "True").lower() in ("true", "1", "t")
+    # Logout revocations and the user and journal caches live in each process, so extra
+    # workers only make sense behind sticky sessions; the reloader always runs one
+    workers = 1 if debug else int(os.getenv("WORKERS", "1"))
     
-    # Run the application
+    # Run the application; uvicorn picks uvloop and httptools when they are installed
     uvicorn.run(
         "app.main:app",
         host=host,
         port=port,
-        reload=debug
+        reload=debug,
+        workers=workers,
+        log_level=os.getenv("LOG_LEVEL", "info").lower()
     ) 
\ No newline at end of file